@@ -0,0 +1 @@
+# Placeholder to create a package
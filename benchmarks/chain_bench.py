@@ -0,0 +1,180 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Time and peak memory of the chain traversals on synthetic graphs.
+Each case runs in its own process, so that one which is too slow can be stopped.
+Run with `python3 -m benchmarks.chain_bench`.
+"""
+
+import argparse
+import multiprocessing
+import random
+import time
+import tracemalloc
+
+import networkx
+
+from biobot import chain
+
+
+def _graph(size, edges):
+    graph = networkx.DiGraph(version=0)
+    for i in range(size):
+        graph.add_node(
+            "user{}".format(i),
+            usernames=("user{}".format(i),),
+            uid=i,
+            deleted=False,
+            about="",
+        )
+    graph.add_edges_from(("user{}".format(a), "user{}".format(b)) for a, b in edges)
+    return graph
+
+
+def long_chain(size, rng):
+    """Every user mentions the next one, the target is at the end"""
+    return _graph(size, ((i, i + 1) for i in range(size - 1))), "user{}".format(
+        size - 1
+    )
+
+
+def forks(size, rng):
+    """A random tree of short branches, which all lead to the target at its root"""
+    return (
+        _graph(size, ((i, max(0, i - rng.randint(1, 10))) for i in range(1, size))),
+        "user0",
+    )
+
+
+def fan_in(size, rng):
+    """Every user mentions the target"""
+    return _graph(size, ((i, 0) for i in range(1, size))), "user0"
+
+
+def nested_cycles(size, rng):
+    """
+    A cycle through every user, split into cycles of 1000 users,
+    which are split into cycles of 100 and then of 10 users
+    """
+    edges = [(i, (i + 1) % size) for i in range(size)]
+    for block in (10, 100, 1000):
+        edges += [
+            (min(start + block, size) - 1, start)
+            for start in range(0, size, block)
+            if min(start + block, size) - start > 1
+        ]
+    return _graph(size, edges), "user{}".format(size - 1)
+
+
+GRAPHS = {
+    "long_chain": long_chain,
+    "forks": forks,
+    "fan_in": fan_in,
+    "nested_cycles": nested_cycles,
+}
+ALGORITHMS = {
+    "make_chain": lambda graph, target: chain.make_chain(graph, target),
+    "make_notinchain": lambda graph, target: chain.make_notinchain(graph, target),
+    "make_all_chains": lambda graph, target: chain.make_all_chains(graph),
+}
+
+
+def _measure(graph_name, algorithm_name, size, seed, memory, results):
+    graph, target = GRAPHS[graph_name](size, random.Random(seed))
+    algorithm = ALGORITHMS[algorithm_name]
+    started = time.perf_counter()
+    algorithm(graph, target)
+    elapsed = time.perf_counter() - started
+    peak = None
+    if memory:
+        # measured separately, since tracing the allocations slows the algorithm down
+        tracemalloc.start()
+        algorithm(graph, target)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    results.put((elapsed, peak))
+
+
+def measure(graph_name, algorithm_name, size, seed=0, memory=True, timeout=None):
+    """Return the seconds taken and peak bytes allocated, or None if it took longer than the timeout"""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_measure,
+        args=(graph_name, algorithm_name, size, seed, memory, results),
+    )
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return None
+    if process.exitcode:
+        raise RuntimeError("{} on {} failed".format(algorithm_name, graph_name))
+    return results.get()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--graphs", nargs="+", choices=GRAPHS, default=list(GRAPHS))
+    parser.add_argument(
+        "--algorithms", nargs="+", choices=ALGORITHMS, default=list(ALGORITHMS)
+    )
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--no-memory", dest="memory", action="store_false")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(
+        "{:>14} {:>16} {:>7} {:>10} {:>10}".format(
+            "graph", "algorithm", "size", "time (s)", "peak (MB)"
+        )
+    )
+    for graph_name in args.graphs:
+        for algorithm_name in args.algorithms:
+            for size in args.sizes:
+                result = measure(
+                    graph_name,
+                    algorithm_name,
+                    size,
+                    args.seed,
+                    args.memory,
+                    args.timeout,
+                )
+                if result is None:
+                    print(
+                        "{:>14} {:>16} {:>7} {:>10}".format(
+                            graph_name, algorithm_name, size, "timeout"
+                        )
+                    )
+                    # the larger sizes would time out too
+                    break
+                elapsed, peak = result
+                print(
+                    "{:>14} {:>16} {:>7} {:>10.3f} {:>10}".format(
+                        graph_name,
+                        algorithm_name,
+                        size,
+                        elapsed,
+                        "-" if peak is None else "{:.1f}".format(peak / 1e6),
+                    ),
+                    flush=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Time of each phase of /diff and /gdiff on synthetic pairs of old and new groups.
+Run with `python3 -m benchmarks.diff_bench`.
+"""
+
+import argparse
+import random
+import time
+
+from biobot import chain, diff, trace
+from biobot.backends.simulated import make_group
+from biobot.user import FullUser, User
+
+FORMATS = ("svg", "svgz", "pdf")
+# spans within the layout, the saves are timed for each format instead
+PHASES = (
+    "diff.generate",
+    "diff.shortest_paths",
+    "diff.kamada_kawai",
+    "diff.pack",
+)
+
+
+def make_pair(size, ratio, seed=0):
+    """
+    Return the graphs of a synthetic group and of the same group after a `ratio` fraction
+    of its members have each left, edited their bio or changed their username, and as many
+    new members as left have joined. Also return a target for the chains.
+    """
+    rng = random.Random(seed)
+    users, bios = make_group(size, seed)
+    usernames = [user.usernames[0] for user in users if user.usernames]
+    old = [FullUser(user, bio) for user, bio in zip(users, bios)]
+    new = []
+    left = 0
+    for user, bio in zip(users, bios):
+        roll = rng.random() * 3
+        if roll < ratio:
+            left += 1
+            continue
+        if roll < ratio * 2:
+            bio = "@" + rng.choice(usernames)
+        elif roll < ratio * 3 and user.usernames:
+            user = User(user.id, ("renamed{}".format(user.id),), False)
+        new.append(FullUser(user, bio))
+    for i in range(left):
+        new.append(
+            FullUser(
+                User(-1 - i, ("joined{}".format(i),), False),
+                "@" + rng.choice(usernames),
+            )
+        )
+    target = next(user for user in reversed(old) if user.usernames).key
+    return chain.make_graph(old), chain.make_graph(new), target
+
+
+def measure(old, new, target):
+    """
+    Return the seconds taken by the textual diff, the layout and the spans of each,
+    and to save the figure in each format. Both diffs generate the diff data, so they
+    are traced separately.
+    """
+    times = {}
+    with trace.trace("textual diff") as textual:
+        started = time.perf_counter()
+        diff.textual_chain_diff(old, new, " → ", "\n")
+        times["textual"] = time.perf_counter() - started
+    with trace.trace("layout") as layout:
+        started = time.perf_counter()
+        fig, bbox = diff.layout_chain_diff(old, new, target)
+        times["layout"] = time.perf_counter() - started
+    for span, (total, _) in textual.spans.items():
+        times["textual." + span.partition(".")[2]] = total
+    for span, (total, _) in layout.spans.items():
+        times[span] = total
+    for format in FORMATS:
+        started = time.perf_counter()
+        diff.save_chain_diff(fig, bbox, format)
+        times[format] = time.perf_counter() - started
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--ratios", type=float, nargs="+", default=[0.01, 0.1, 0.5])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    columns = ("textual", "textual.generate", "layout") + PHASES + FORMATS
+    print(
+        "{:>6} {:>6} ".format("size", "ratio")
+        + " ".join("{:>19}".format(column) for column in columns)
+    )
+    for size in args.sizes:
+        for ratio in args.ratios:
+            times = measure(*make_pair(size, ratio, args.seed))
+            print(
+                "{:>6} {:>6} ".format(size, ratio)
+                + " ".join(
+                    "{:>19.3f}".format(times.get(column, 0)) for column in columns
+                ),
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+End-to-end load test of full crawls, through the backend manager, against simulated backends.
+Nothing is sent over the network, so scheduler changes can be compared on any machine.
+Run with `python3 -m benchmarks.load`.
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from biobot import chain, core, metrics, trace
+from biobot.backend_manager import BackendManager
+from biobot.backends.simulated import make_group
+from biobot.user import FullUser
+
+
+def make_config(args):
+    group = {
+        "members": args.members,
+        "seed": args.seed,
+        "cycle_rate": args.cycle_rate,
+        "fork_rate": args.fork_rate,
+    }
+    return {
+        "common": {},
+        "backend": {
+            "SimulatedBackend": [
+                {
+                    **group,
+                    "name": "sim{}".format(i),
+                    "latency": args.latency,
+                    "tail_rate": args.tail_rate,
+                    "flood_rate": args.flood_rate,
+                    "flood_seconds": args.flood_seconds,
+                    # only the first backend is banned, so that the others can finish
+                    "broken_after": args.broken_after if i == 0 else None,
+                    "concurrency": args.concurrency,
+                }
+                for i in range(args.backends)
+            ]
+        },
+    }
+
+
+async def crawl(manager, i):
+    with trace.trace("crawl {}".format(i)) as ret:
+        snapshot = await core.get_snapshot(manager, max_age=0)
+    return snapshot, ret
+
+
+async def run(args):
+    async with BackendManager(make_config(args), None) as manager:
+        manager.recreate_delay = args.recreate_delay
+        started = time.monotonic()
+        results = await asyncio.gather(*[crawl(manager, i) for i in range(args.crawls)])
+        elapsed = time.monotonic() - started
+    users, bios = make_group(
+        args.members, args.seed, cycle_rate=args.cycle_rate, fork_rate=args.fork_rate
+    )
+    expected = {user: bio for user, bio in zip(users, bios)}
+    expected_chain = len(
+        chain.make_chain(
+            chain.make_graph([FullUser(*item) for item in expected.items()]),
+            users[-1].key,
+        )
+    )
+    for snapshot, ret in results:
+        wrong = sum(
+            expected.get(user.user, None) != user.about for user in snapshot.users
+        )
+        print(
+            "{} ({} users, {} wrong, chain of {}/{})".format(
+                ret.summary(),
+                len(snapshot.users),
+                wrong,
+                len(chain.make_chain(snapshot.graph, users[-1].key)),
+                expected_chain,
+            )
+        )
+    print(
+        "{} crawls of {} users in {:.3f}s ({:.0f} bios/s)".format(
+            args.crawls, args.members, elapsed, args.crawls * args.members / elapsed
+        )
+    )
+    print("\n".join(metrics.summarise()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--crawls", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--tail-rate", type=float, default=0.01)
+    parser.add_argument("--flood-rate", type=float, default=0.001)
+    parser.add_argument("--flood-seconds", type=float, default=2)
+    parser.add_argument("--broken-after", type=int, default=None)
+    parser.add_argument("--recreate-delay", type=float, default=5)
+    parser.add_argument("--cycle-rate", type=float, default=0.1)
+    parser.add_argument("--fork-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="CRITICAL")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+CPU cost of queueing requests, with and without per-backend queues.
+Every backend answers instantly, so the measured time is spent on queueing alone.
+Run with `python3 -m benchmarks.scheduler_bench`.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from biobot.scheduler import Request, Scheduler
+
+
+def make_requests(jobs, backends, excluded):
+    """Requests that are each not allowed on `excluded` random backends"""
+    ret = []
+    for i in range(jobs):
+        allowed = set(range(backends))
+        allowed.difference_update(random.sample(range(backends), excluded))
+        ret.append(Request(0, (i,), {}, None, allowed, 0))
+    return ret
+
+
+# Give up on the shared queue after this many requeues per request
+MAX_REQUEUES = 100
+
+
+async def run_shared_queue(requests, backends):
+    """
+    The previous design: one queue, requests not allowed on the actor are put back.
+    The actors can end up taking requests in lockstep with the order of the queue,
+    so that none of them ever gets one it is allowed to serve.
+    """
+    queue = asyncio.Queue()
+    remaining = len(requests)
+    done = asyncio.Event()
+    requeued = 0
+
+    async def act(backend_id):
+        nonlocal remaining, requeued
+        while True:
+            await asyncio.sleep(0)
+            request = await queue.get()
+            if backend_id not in request.allowed_backends:
+                queue.put_nowait(request)
+                requeued += 1
+                if requeued > MAX_REQUEUES * len(requests):
+                    done.set()
+                continue
+            remaining -= 1
+            if not remaining:
+                done.set()
+
+    for request in requests:
+        queue.put_nowait(request)
+    tasks = [asyncio.create_task(act(backend_id)) for backend_id in range(backends)]
+    await done.wait()
+    for task in tasks:
+        task.cancel()
+    return requeued
+
+
+async def run_scheduler(requests, backends):
+    scheduler = Scheduler(lambda backend_id: 1.0)
+    for backend_id in range(backends):
+        scheduler.add_backend(backend_id)
+    remaining = len(requests)
+    done = asyncio.Event()
+
+    async def act(backend_id):
+        nonlocal remaining
+        while True:
+            await asyncio.sleep(0)
+            await scheduler.get(backend_id)
+            remaining -= 1
+            if not remaining:
+                done.set()
+
+    for request in requests:
+        scheduler.put(request)
+    tasks = [asyncio.create_task(act(backend_id)) for backend_id in range(backends)]
+    await done.wait()
+    for task in tasks:
+        task.cancel()
+    return 0
+
+
+def measure(run, requests, backends):
+    started = time.process_time()
+    requeued = asyncio.run(run(requests, backends))
+    return time.process_time() - started, requeued
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=10000)
+    parser.add_argument("--backends", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(
+        "{:>8} {:>16} {:>10} {:>10}".format("excluded", "design", "cpu (s)", "requeued")
+    )
+    for excluded in range(args.backends):
+        random.seed(args.seed)
+        requests = make_requests(args.jobs, args.backends, excluded)
+        for name, run in (
+            ("shared queue", run_shared_queue),
+            ("scheduler", run_scheduler),
+        ):
+            cpu, requeued = measure(run, requests, args.backends)
+            print(
+                "{:>8} {:>16} {:>10.3f} {:>10}{}".format(
+                    excluded,
+                    name,
+                    cpu,
+                    requeued,
+                    " (gave up)" if requeued > MAX_REQUEUES * args.jobs else "",
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -19,9 +19,15 @@ import asyncio
 import json
 import logging
 
-from . import backend_manager, bot, log
+from . import backend_manager, bot, log, metrics
 
 log.init().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Writing the metrics failed", exc_info=task.exception())
 
 
 async def main():
@@ -29,11 +35,33 @@ async def main():
     parser.add_argument("-f", "-c", "--config", default="config.json", type=open)
     args = parser.parse_args()
     config = json.load(args.config)
-    frontend = bot.BioBot(main_group=config["common"]["group_id"], **config["frontend"])
-    client = await frontend.init()
-    async with backend_manager.BackendManager(config, client) as backend:
-        await frontend.run(backend)
-    assert False
+    metrics_config = config.get("metrics", {})
+    runner = None
+    writer = None
+    try:
+        if "port" in metrics_config:
+            runner = await metrics.serve(
+                metrics_config["port"], metrics_config.get("host", "127.0.0.1")
+            )
+        if "file" in metrics_config:
+            writer = asyncio.create_task(
+                metrics.write_periodically(
+                    metrics_config["file"], metrics_config.get("interval", 15)
+                )
+            )
+            writer.add_done_callback(_log_failure)
+        frontend = bot.BioBot(
+            main_group=config["common"]["group_id"], **config["frontend"]
+        )
+        client = await frontend.init()
+        async with backend_manager.BackendManager(config, client) as backend:
+            await frontend.run(backend)
+        assert False
+    finally:
+        if writer is not None:
+            writer.cancel()
+        if runner is not None:
+            await runner.cleanup()
 
 
 asyncio.run(main())
@@ -16,7 +16,7 @@
 
 import logging
 from abc import ABC, abstractmethod
-from typing import Iterable
+from typing import AsyncIterator, Iterable, Union
 
 import telethon
 
@@ -39,8 +39,8 @@ class Backend(ABC):
     ) -> Iterable["Backend"]:
         """Return an iterable of instances that implement Backend"""
 
-    async def init(self):
-        """Initialise the class"""
+    async def init(self, interactive: bool = True):
+        """Initialise the class, without asking for input unless interactive is set"""
 
     async def close(self):
         """Prepare for destruction, this may be called multiple times"""
@@ -51,6 +51,10 @@ class JoinedUsersGetterBackend(Backend):
     async def get_joined_users(self) -> Iterable[User]:
         """Fetch the users in the group, returning an iterable"""
 
+    async def iter_joined_users(self) -> AsyncIterator[list[User]]:
+        """Fetch the users in the group, yielding them in pages as soon as they are available"""
+        yield list(await self.get_joined_users())
+
 
 class BioTextGetterBackend(Backend):
     @abstractmethod
@@ -58,6 +62,12 @@ class BioTextGetterBackend(Backend):
         """Return the user's bio text"""
 
 
+class BatchBioTextGetterBackend(BioTextGetterBackend):
+    @abstractmethod
+    async def get_bio_texts(self, users: list[User]) -> list[Union[str, BaseException]]:
+        """Return each user's bio text, or the exception raised while fetching it"""
+
+
 class Unavailable(RuntimeError):
     def __init__(self, message: str, seconds: float = 0, retry_elsewhere: bool = False):
         super().__init__(message)
@@ -65,5 +75,12 @@ class Unavailable(RuntimeError):
         self.retry_elsewhere = retry_elsewhere
 
 
+class NotFound(Unavailable):
+    """The user can't be found by this backend, but might be by the others"""
+
+    def __init__(self, message: str):
+        super().__init__(message, retry_elsewhere=True)
+
+
 class Broken(RuntimeError):
     pass
@@ -15,32 +15,111 @@
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import dataclasses
+import functools
 import itertools
 import logging
+import time
 
-from . import backends
-from .backend import BioTextGetterBackend, Broken, JoinedUsersGetterBackend, Unavailable
+from . import backends, metrics, trace
+from .backend import (
+    BatchBioTextGetterBackend,
+    BioTextGetterBackend,
+    Broken,
+    JoinedUsersGetterBackend,
+    NotFound,
+    Unavailable,
+)
+from .scheduler import (
+    PRIORITY_NAMES,
+    Request,
+    Scheduler,
+    current_deadline,
+    current_flow,
+    current_priority,
+)
+from .stats import BackendStats, LatencyStats
 
 logger = logging.getLogger(__name__)
 
 OP_JOINED = 0
 OP_BIO = 1
+OP_JOINED_PAGES = 2
+OPERATION_NAMES = ("joined", "bio", "joined_pages")
+# the result of a request that was answered by another backend first
+_SUPERSEDED = object()
 
 
-class BackendManager(JoinedUsersGetterBackend, BioTextGetterBackend):
+def _expire(fut):
+    if not fut.done():
+        fut.set_exception(asyncio.TimeoutError("Deadline exceeded"))
+
+
+async def _stream_joined_users(backend, callback):
+    async for page in backend.iter_joined_users():
+        callback(page)
+
+
+class BackendManager(JoinedUsersGetterBackend, BatchBioTextGetterBackend):
     _operations = (
         (lambda x: x.get_joined_users, JoinedUsersGetterBackend),
         (lambda x: x.get_bio_text, BioTextGetterBackend),
+        (
+            lambda x: functools.partial(_stream_joined_users, x),
+            JoinedUsersGetterBackend,
+        ),
     )
+    # Backends implementing these are passed a list of the first argument of several requests at once
+    _batch_operations = {
+        OP_BIO: (lambda x: x.get_bio_texts, BatchBioTextGetterBackend),
+    }
+    # Timeout of a call until enough of its latencies are known
     request_timeout = 10.0
+    # Afterwards, the timeout is this quantile of the latencies multiplied by timeout_factor,
+    # limited to the (floor, ceiling) of the operation, which may be overridden in the config
+    timeout_quantile = 0.99
+    timeout_factor = 3
+    timeout_min_samples = 20
+    timeout_limits = {
+        OP_JOINED: (30.0, 600.0),
+        OP_BIO: (1.0, 30.0),
+        OP_JOINED_PAGES: (30.0, 600.0),
+    }
+    batch_size = 10
+    # Requests of these operations that take longer than this quantile of the backend's latency
+    # are also sent to another backend, and the first result is used. None disables hedging.
+    _hedged_operations = {OP_BIO}
+    hedge_quantile = 0.95
+    hedge_min_samples = 20
+    # Broken backends are recreated after this many seconds, doubled after each failure
+    recreate_delay = 30.0
+    max_recreate_delay = 3600.0
+    # Backends that couldn't find what a request is for aren't asked again for this many seconds,
+    # or until their roster is due to be relisted if that is sooner
+    not_found_ttl = 3600.0
 
     def __init__(self, config, bot):
         self._dead = False
         self._config = config
         self._bot = bot
         self._backends = []
+        # (class, common config, config, index) that each backend was created from
+        self._sources = []
+        # number of actors for each operation of each backend
+        self._concurrency = []
+        # (floor, ceiling) of the timeout of each operation of each backend
+        self._timeout_limits = []
         self._tasks = []
-        self._queues = [asyncio.Queue() for _ in self._operations]
+        self._stats = []
+        # expiry of the (operation, args) of the requests that each backend couldn't find
+        self._not_found = []
+        self._recreators = {}
+        # time from queueing each request to its result, by priority class
+        self._priority_stats = [LatencyStats() for _ in PRIORITY_NAMES]
+        self._schedulers = [
+            Scheduler(functools.partial(self._get_cost, operation_i))
+            for operation_i in range(len(self._operations))
+        ]
 
     @classmethod
     def get_instances(cls, bot, common_config, configs):
@@ -50,11 +129,35 @@ class BackendManager(JoinedUsersGetterBackend, BioTextGetterBackend):
         backend_config = self._config["backend"]
         common_config = self._config["common"]
         # Create backends
-        for module, config in backend_config.items():
-            backend = getattr(backends, module)
-            self._backends += backend.get_instances(self._bot, common_config, config)
-        # Prepare list of tasks for each backend
+        for module, configs in backend_config.items():
+            backend_class = getattr(backends, module)
+            for config in configs:
+                config = dict(config)
+                concurrency = config.pop("concurrency", 1)
+                timeout_limits = {
+                    **self.timeout_limits,
+                    **{
+                        OPERATION_NAMES.index(name): tuple(limits)
+                        for name, limits in config.pop("timeouts", {}).items()
+                    },
+                }
+                # copied so that the backend can be created again from the same config
+                instances = list(
+                    backend_class.get_instances(
+                        self._bot, common_config, [dict(config)]
+                    )
+                )
+                self._backends += instances
+                self._sources += [
+                    (backend_class, common_config, config, index)
+                    for index in range(len(instances))
+                ]
+                self._concurrency += [concurrency] * len(instances)
+                self._timeout_limits += [timeout_limits] * len(instances)
+        # Prepare list of tasks and statistics for each backend
         self._tasks = [[] for _ in self._backends]
+        self._stats = [{} for _ in self._backends]
+        self._not_found = [{} for _ in self._backends]
         # Initialise all backends
         results = await asyncio.gather(
             *[backend.init() for backend in self._backends], return_exceptions=True
@@ -66,17 +169,45 @@ class BackendManager(JoinedUsersGetterBackend, BioTextGetterBackend):
                 self._backends[backend_i] = None
                 continue
             backend.logger.debug("Backend ID %d", backend_i)
-            # Launch tasks
-            for operation_i, (operation, test_class) in enumerate(self._operations):
-                if isinstance(backend, test_class):
-                    self._tasks[backend_i].append(
-                        asyncio.create_task(
-                            self._act(operation, operation_i, backend, backend_i)
-                        )
-                    )
+            self._start_backend(backend, backend_i)
         if all(backend is None for backend in self._backends):
             logger.critical("All backends failed to initialise")
             self._dead = True
+        else:
+            metrics.REGISTRY.collectors.append(self._collect_metrics)
+
+    def _collect_metrics(self):
+        for operation_i, scheduler in enumerate(self._schedulers):
+            metrics.queue_depth.set(
+                len(scheduler), operation=OPERATION_NAMES[operation_i]
+            )
+        metrics.backends_up.set(
+            sum(backend is not None for backend in self._backends or ())
+        )
+
+    def _start_backend(self, backend, backend_id):
+        # a recreated backend may find what its predecessor couldn't
+        self._not_found[backend_id] = {}
+        # Launch tasks
+        for operation_i, (operation, test_class) in enumerate(self._operations):
+            batch_size = None
+            if operation_i in self._batch_operations:
+                batch_operation, batch_class = self._batch_operations[operation_i]
+                if isinstance(backend, batch_class):
+                    operation = batch_operation
+                    batch_size = self.batch_size
+            if isinstance(backend, test_class):
+                concurrency = self._concurrency[backend_id]
+                self._stats[backend_id][operation_i] = BackendStats()
+                self._schedulers[operation_i].add_backend(backend_id, concurrency)
+                for _ in range(concurrency):
+                    self._tasks[backend_id].append(
+                        asyncio.create_task(
+                            self._act(
+                                operation, operation_i, backend, backend_id, batch_size
+                            )
+                        )
+                    )
 
     async def __aenter__(self):
         await self.init()
@@ -87,10 +218,16 @@ class BackendManager(JoinedUsersGetterBackend, BioTextGetterBackend):
             return
         self._dead = True
         self._config = None
+        if self._collect_metrics in metrics.REGISTRY.collectors:
+            metrics.REGISTRY.collectors.remove(self._collect_metrics)
         # Cancel all tasks
-        for task in itertools.chain.from_iterable(self._tasks):
+        tasks = [
+            *itertools.chain.from_iterable(self._tasks),
+            *self._recreators.values(),
+        ]
+        for task in tasks:
             task.cancel()
-        for task in itertools.chain.from_iterable(self._tasks):
+        for task in tasks:
             try:
                 await task
             except asyncio.CancelledError:
@@ -98,35 +235,20 @@ class BackendManager(JoinedUsersGetterBackend, BioTextGetterBackend):
             except BaseException as e:
                 logger.exception("Failed to cancel %r", task)
         self._tasks.clear()
+        self._recreators.clear()
         # Close all backends
         await asyncio.gather(
             *[backend.close() for backend in self._backends if backend is not None]
         )
         self._backends = None
         # Abort all pending requests
-        for queue_i, queue in enumerate(self._queues):
-            while True:
-                try:
-                    args, kwargs, fut, _, _ = queue.get_nowait()
-                except asyncio.QueueEmpty:
-                    break
-                if not fut.done():
-                    logger.debug(
-                        "Aborting pending task on %d (%r, %r) for %r",
-                        queue_i,
-                        args,
-                        kwargs,
-                        fut,
-                    )
-                    fut.set_exception(RuntimeError("Shutting down"))
+        for scheduler in self._schedulers:
+            for request in scheduler.drain():
+                if not request.fut.done():
+                    logger.debug("Aborting pending %r for %r", request, request.fut)
+                    request.fut.set_exception(RuntimeError("Shutting down"))
                 else:
-                    logger.debug(
-                        "Ignoring done task on %d (%r, %r) for %r",
-                        queue_i,
-                        args,
-                        kwargs,
-                        fut,
-                    )
+                    logger.debug("Ignoring done %r for %r", request, request.fut)
 
     async def __aexit__(self, exc_type, exc, tb):
         await self.close()
@@ -147,11 +269,47 @@ class BackendManager(JoinedUsersGetterBackend, BioTextGetterBackend):
         # Remove backend
         if backend in self._backends:
             self._backends[backend_id] = None
+            # Hand the requests queued for it to the other backends
+            for scheduler in self._schedulers:
+                if scheduler.can_serve((backend_id,)):
+                    for request in scheduler.remove_backend(backend_id):
+                        self._requeue(request)
             # Close backend
             await backend.close()
             if all(backend is None for backend in self._backends):
-                logger.critical("No more serviceable backends!")
-                await self.close()
+                logger.critical("No more serviceable backends until one is recreated!")
+            if not self._dead:
+                self._recreators[backend_id] = asyncio.create_task(
+                    self._recreate_backend(backend_id)
+                )
+
+    async def _recreate_backend(self, backend_id):
+        backend_class, common_config, config, index = self._sources[backend_id]
+        delay = self.recreate_delay
+        while True:
+            logger.info("Recreating backend %d in %d seconds", backend_id, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_recreate_delay)
+            backend = None
+            try:
+                backend = list(
+                    backend_class.get_instances(
+                        self._bot, common_config, [dict(config)]
+                    )
+                )[index]
+                await backend.init(interactive=False)
+            except BaseException as e:
+                if backend is not None:
+                    await asyncio.shield(backend.close())
+                if not isinstance(e, Exception):
+                    raise
+                logger.error("Failed to recreate backend %d", backend_id, exc_info=e)
+                continue
+            break
+        backend.logger.info("Recreated backend %d", backend_id)
+        del self._recreators[backend_id]
+        self._backends[backend_id] = backend
+        self._start_backend(backend, backend_id)
 
     async def _do(self, operation, *args, **kwargs):
         if self._dead:
@@ -164,128 +322,396 @@ class BackendManager(JoinedUsersGetterBackend, BioTextGetterBackend):
     def get_bio_text(self, user):
         return self._do(OP_BIO, user)
 
-    async def _get_queue(self, operation):
-        return await self._queues[operation].get()
+    async def get_bio_texts(self, users):
+        if self._dead:
+            raise RuntimeError("No serviceable backends available!")
+        # the requests are batched again by the actors of backends that support it
+        return await asyncio.gather(
+            *[self._put_queue(OP_BIO, (user,), {}) for user in users],
+            return_exceptions=True,
+        )
 
-    def _put_queue(
-        self, operation, args, kwargs, fut=None, allowed_backends=None, retry_count=5
-    ):
-        if fut is None:
-            fut = asyncio.Future()
-        if allowed_backends and all(
-            self._backends[backend] is None for backend in allowed_backends
-        ):
+    async def iter_joined_users(self):
+        if self._dead:
+            raise RuntimeError("No serviceable backends available!")
+        pages = asyncio.Queue()
+        fut = self._put_queue(OP_JOINED_PAGES, (pages.put_nowait,), {})
+        # if the listing is retried on another backend, the pages are sent again
+        seen = set()
+        try:
+            while True:
+                getter = asyncio.ensure_future(pages.get())
+                try:
+                    await asyncio.wait(
+                        (getter, fut), return_when=asyncio.FIRST_COMPLETED
+                    )
+                except BaseException:
+                    getter.cancel()
+                    raise
+                if not getter.done():
+                    # the listing is done and every page has been consumed
+                    getter.cancel()
+                    break
+                page = [user for user in getter.result() if user.key not in seen]
+                seen.update(user.key for user in page)
+                if page:
+                    yield page
+            fut.result()
+        finally:
+            # withdraw the listing if the caller stopped early
+            fut.cancel()
+
+    def _get_cost(self, operation, backend_id):
+        return self._stats[backend_id][operation].cost
+
+    def get_priority_stats(self):
+        """Return the latency statistics of requests for each priority class"""
+        return dict(zip(PRIORITY_NAMES, self._priority_stats))
+
+    def _record_priority_stats(self, priority, started, fut):
+        self._priority_stats[priority].record(
+            time.monotonic() - started, not fut.cancelled() and not fut.exception()
+        )
+
+    def _put_queue(self, operation, args, kwargs, priority=None):
+        """
+        Queue a request and return its future.
+        Cancelling the future withdraws the request, and the future fails with
+        asyncio.TimeoutError if it isn't done by the deadline of the current context.
+        """
+        if priority is None:
+            priority = current_priority.get()
+        fut = asyncio.Future()
+        fut.add_done_callback(
+            functools.partial(self._record_priority_stats, priority, time.monotonic())
+        )
+        deadline = current_deadline.get()
+        if deadline is not None:
+            handle = asyncio.get_running_loop().call_later(
+                deadline - time.monotonic(), _expire, fut
+            )
+            fut.add_done_callback(lambda fut: handle.cancel())
+        allowed_backends = self._allowed_backends(operation, args)
+        flow, weight = current_flow.get()
+        self._requeue(
+            Request(
+                operation,
+                args,
+                kwargs,
+                fut,
+                allowed_backends,
+                5,
+                priority,
+                flow,
+                weight,
+                deadline=deadline,
+                trace=trace.current_trace.get(),
+            )
+        )
+        return fut
+
+    def _requeue(self, request):
+        if request.fut.done():
+            logger.debug("Dropping answered %r", request)
+            return
+        scheduler = self._schedulers[request.operation]
+        if request.hedge and not scheduler.can_serve(request.allowed_backends):
+            # the original request is still running
+            logger.debug("Dropping hedge %r", request)
+            return
+        if not scheduler.can_serve(request.allowed_backends):
             # No more allowed backends
-            if retry_count:
-                retry_count -= 1
-                allowed_backends = None
+            allowed_backends = self._allowed_backends(request.operation, request.args)
+            if not allowed_backends:
+                logger.debug("Not found by any backend on %r", request)
+                if not request.fut.done():
+                    request.fut.set_exception(NotFound("Not found by any backend"))
+                return
+            if request.retry_count:
+                request.retry_count -= 1
+                request.allowed_backends = allowed_backends
                 logger.warning(
-                    "No backends remaining on %d (%r, %r) for %r, resetting (remaining %d)",
-                    operation,
-                    args,
-                    kwargs,
-                    fut,
-                    retry_count,
+                    "No backends remaining on %r for %r, resetting (remaining %d)",
+                    request,
+                    request.fut,
+                    request.retry_count,
                 )
-            else:
+            if not scheduler.can_serve(request.allowed_backends):
                 logger.error(
-                    "No backends remaining on %d (%r, %r) for %r, failing",
-                    operation,
-                    args,
-                    kwargs,
-                    fut,
+                    "No backends remaining on %r for %r, failing", request, request.fut
                 )
-                fut.set_exception(RuntimeError("No backends remaining"))
-                return fut
-        if allowed_backends is None:
-            # Allow all backends by default
-            allowed_backends = set(range(len(self._backends)))
-        self._queues[operation].put_nowait(
-            (args, kwargs, fut, allowed_backends, retry_count)
+                if not request.fut.done():
+                    request.fut.set_exception(RuntimeError("No backends remaining"))
+                return
+        scheduler.put(request)
+
+    def _allowed_backends(self, operation, args):
+        """All the backends, except those that recently couldn't find what the request is for"""
+        now = time.monotonic()
+        ret = set()
+        for backend_id, not_found in enumerate(self._not_found):
+            expiry = not_found.get((operation, args), None)
+            if expiry is not None:
+                if expiry > now:
+                    continue
+                del not_found[(operation, args)]
+            ret.add(backend_id)
+        return ret
+
+    def _record_not_found(self, backend, backend_id, key):
+        """Skip the backend for the key until it may have indexed the user since"""
+        # a backend that keeps a roster can find a user again once it is relisted
+        ttl = min(
+            self.not_found_ttl, getattr(backend, "roster_ttl", self.not_found_ttl)
         )
-        return fut
+        now = time.monotonic()
+        not_found = self._not_found[backend_id]
+        # the ttl is the same for all entries of a backend, so they are in order of expiry
+        while not_found:
+            oldest = next(iter(not_found))
+            if not_found[oldest] > now:
+                break
+            del not_found[oldest]
+        not_found.pop(key, None)
+        not_found[key] = now + ttl
+
+    def _get_timeout(self, operation, backend_id):
+        stats = self._stats[backend_id][operation]
+        if stats.histogram.count < self.timeout_min_samples:
+            timeout = self.request_timeout
+        else:
+            timeout = (
+                stats.histogram.quantile(self.timeout_quantile) * self.timeout_factor
+            )
+        floor, ceiling = self._timeout_limits[backend_id][operation]
+        return min(max(timeout, floor), ceiling)
+
+    def _get_hedge_delay(self, operation, stats):
+        if (
+            self.hedge_quantile is None
+            or operation not in self._hedged_operations
+            or stats.histogram.count < self.hedge_min_samples
+        ):
+            return None
+        return stats.histogram.quantile(self.hedge_quantile)
+
+    def _hedge(self, requests, backend_id):
+        for request in requests:
+            if request.hedge or request.fut.done():
+                continue
+            scheduler = self._schedulers[request.operation]
+            allowed_backends = request.allowed_backends - {backend_id}
+            if not scheduler.can_serve(allowed_backends):
+                continue
+            logger.debug("Hedging %r on %r", request, allowed_backends)
+            scheduler.put(
+                dataclasses.replace(
+                    request,
+                    allowed_backends=allowed_backends,
+                    retry_count=0,
+                    hedge=True,
+                )
+            )
+
+    async def _call(
+        self, op, requests, backend, backend_id, batch_size, timeout, hedge_delay
+    ):
+        """
+        Run the operation for the requests, hedging them after hedge_delay seconds.
+        Returns a result for each request, which is _SUPERSEDED if it was answered elsewhere first
+        and a TimeoutError if it took longer than the timeout.
+        """
+        if batch_size:
+            backend.logger.debug("Starting batch of %d %.1f", len(requests), timeout)
+            # one task per request, so that a slow one doesn't hold up the results of the others
+            tasks = [
+                asyncio.ensure_future(op([request.args[0]])) for request in requests
+            ]
+        else:
+            request = requests[0]
+            backend.logger.debug("Starting %r %.1f", request.args, timeout)
+            tasks = [asyncio.ensure_future(op(*request.args, **request.kwargs))]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        hedge_at = None if hedge_delay is None else loop.time() + hedge_delay
+        try:
+            while True:
+                pending = [
+                    (task, request.fut)
+                    for task, request in zip(tasks, requests)
+                    if not task.done() and not request.fut.done()
+                ]
+                now = loop.time()
+                if not pending or now >= deadline:
+                    break
+                if hedge_at is not None and now >= hedge_at:
+                    self._hedge(requests, backend_id)
+                    hedge_at = None
+                wake = deadline if hedge_at is None else min(hedge_at, deadline)
+                await asyncio.wait(
+                    [aw for waitable in pending for aw in waitable],
+                    timeout=wake - now,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+        results = []
+        for task, request in zip(tasks, requests):
+            if task.cancelled():
+                results.append(
+                    _SUPERSEDED if request.fut.done() else asyncio.TimeoutError()
+                )
+            elif task.exception() is not None:
+                results.append(task.exception())
+            else:
+                results.append(task.result()[0] if batch_size else task.result())
+        return results
 
-    async def _act(self, operation, operation_i, backend, backend_id):
+    async def _act(self, operation, operation_i, backend, backend_id, batch_size=None):
         op = operation(backend)
+        stats = self._stats[backend_id][operation_i]
+        scheduler = self._schedulers[operation_i]
+        labels = {
+            "backend": "{}/{}".format(type(backend).__name__, backend_id),
+            "operation": OPERATION_NAMES[operation_i],
+        }
+        count = functools.partial(metrics.backend_requests.inc, 1, **labels)
         while True:
             await asyncio.sleep(0)  # prevent a single actor hogging the thread
-            args, kwargs, fut, allowed_backends, retry_count = await self._get_queue(
-                operation_i
-            )
-            if backend_id not in allowed_backends:
-                self._put_queue(operation_i, args, kwargs, fut, allowed_backends)
+            requests = [await scheduler.get(backend_id)]
+            while batch_size and len(requests) < batch_size:
+                try:
+                    requests.append(scheduler.get_nowait(backend_id))
+                except asyncio.QueueEmpty:
+                    break
+            # requests that were answered by a hedge, cancelled or expired while they were queued
+            requests = [request for request in requests if not request.fut.done()]
+            if not requests:
                 continue
+            started = time.monotonic()
+            for request in requests:
+                if request.trace is not None:
+                    request.trace.add(
+                        "queue." + labels["operation"], started - request.queued
+                    )
             try:
-                backend.logger.debug("Starting %r %d", args, self.request_timeout)
-                ret = await asyncio.wait_for(
-                    op(*args, **kwargs), timeout=self.request_timeout
+                results = await self._call(
+                    op,
+                    requests,
+                    backend,
+                    backend_id,
+                    batch_size,
+                    self._get_timeout(operation_i, backend_id),
+                    self._get_hedge_delay(operation_i, stats),
                 )
+            except asyncio.CancelledError as e:
+                # actor cancelled, return to queue
+                for request in requests:
+                    self._requeue(request)
+                backend.logger.debug("Cancelled", exc_info=e)
+                raise
             except BaseException as e:
-                if isinstance(e, Unavailable):
-                    if e.retry_elsewhere:
-                        allowed_backends.remove(backend_id)
-                    backend.logger.debug(
-                        "Unavailable on %d (%r, %r) for %r (next %r) (delay %d)",
-                        operation_i,
-                        args,
-                        kwargs,
-                        fut,
-                        allowed_backends,
-                        e.seconds,
-                        exc_info=e,
+                results = [e] * len(requests)
+            else:
+                # a call cut short by a timeout or by the hedges says little about its latency
+                if not any(
+                    isinstance(result, asyncio.TimeoutError) for result in results
+                ) and any(result is not _SUPERSEDED for result in results):
+                    stats.histogram.record(time.monotonic() - started)
+                    metrics.backend_call_seconds.observe(
+                        time.monotonic() - started, **labels
                     )
-                    self._put_queue(
-                        operation_i, args, kwargs, fut, allowed_backends, retry_count
+            for request in requests:
+                if request.trace is not None:
+                    request.trace.add(
+                        "backend." + labels["operation"], time.monotonic() - started
                     )
-                    await asyncio.sleep(e.seconds)
-                elif isinstance(e, asyncio.TimeoutError):
-                    backend.logger.warning(
-                        "Timed out on %d (%r, %r) for %r",
-                        operation_i,
-                        args,
-                        kwargs,
-                        fut,
-                        exc_info=e,
-                    )
-                    self._put_queue(
-                        operation_i, args, kwargs, fut, allowed_backends, retry_count
+            latency = (time.monotonic() - started) / len(requests)
+            delay = 0
+            broken = False
+            for request, result in zip(requests, results):
+                fut = request.fut
+                if result is _SUPERSEDED:
+                    # the latency is only a lower bound, but it still makes a stuck backend look slow
+                    stats.record(latency, True)
+                    count(result="superseded")
+                    continue
+                # errors other than these are answers from the backend, just not bios
+                stats.record(
+                    latency,
+                    isinstance(result, NotFound)
+                    or not isinstance(
+                        result,
+                        (
+                            Unavailable,
+                            Broken,
+                            asyncio.TimeoutError,
+                            asyncio.CancelledError,
+                        ),
+                    ),
+                )
+                if not isinstance(result, BaseException):
+                    backend.logger.debug("Success on %r for %r", request, fut)
+                    count(result="success")
+                    if not fut.done():
+                        fut.set_result(result)
+                elif isinstance(result, NotFound):
+                    count(result="not_found")
+                    self._record_not_found(
+                        backend, backend_id, (request.operation, request.args)
                     )
-                elif isinstance(e, Broken):
-                    backend.logger.exception(
-                        "Broken on %d (%r, %r) for %r", operation_i, args, kwargs, fut
+                    request.allowed_backends.discard(backend_id)
+                    backend.logger.debug(
+                        "Not found on %r for %r (next %r)",
+                        request,
+                        fut,
+                        request.allowed_backends,
                     )
-                    logging.debug("Remaining backends: %r", self._backends)
-                    self._put_queue(
-                        operation_i, args, kwargs, fut, allowed_backends, retry_count
+                    self._requeue(request)
+                elif isinstance(result, Unavailable):
+                    count(result="unavailable")
+                    if result.retry_elsewhere:
+                        request.allowed_backends.discard(backend_id)
+                    backend.logger.debug(
+                        "Unavailable on %r for %r (next %r) (delay %d)",
+                        request,
+                        fut,
+                        request.allowed_backends,
+                        result.seconds,
+                        exc_info=result,
                     )
-                    await asyncio.shield(
-                        self._close_backend(
-                            self._tasks[backend_id], backend, backend_id
-                        )
+                    self._requeue(request)
+                    delay = max(delay, result.seconds)
+                elif isinstance(result, (asyncio.TimeoutError, asyncio.CancelledError)):
+                    count(result="timeout")
+                    backend.logger.warning(
+                        "Timed out on %r for %r", request, fut, exc_info=result
                     )
+                    self._requeue(request)
+                elif isinstance(result, Broken):
+                    count(result="broken")
                     backend.logger.error(
-                        "Failed actor %d was not cancelled", operation_i
-                    )
-                    return
-                elif isinstance(e, asyncio.CancelledError):
-                    # actor cancelled, return to queue
-                    self._put_queue(
-                        operation_i, args, kwargs, fut, allowed_backends, retry_count
+                        "Broken on %r for %r", request, fut, exc_info=result
                     )
-                    backend.logger.debug("Cancelled", exc_info=e)
-                    raise
+                    self._requeue(request)
+                    broken = True
                 else:
+                    count(result="error")
                     backend.logger.warning(
-                        "Exception on %d (%r, %r) for %r",
-                        operation_i,
-                        args,
-                        kwargs,
-                        fut,
-                        exc_info=e,
+                        "Exception on %r for %r", request, fut, exc_info=result
                     )
-                    fut.set_exception(e)
-            else:
-                backend.logger.debug(
-                    "Success on %d (%r, %r) for %r", operation_i, args, kwargs, fut
+                    if request.hedge:
+                        # the original request is still running and gets to answer
+                        logger.debug("Dropping failed hedge %r", request)
+                    elif not fut.done():
+                        fut.set_exception(result)
+            if broken:
+                logging.debug("Remaining backends: %r", self._backends)
+                await asyncio.shield(
+                    self._close_backend(self._tasks[backend_id], backend, backend_id)
                 )
-                fut.set_result(ret)
+                backend.logger.error("Failed actor %d was not cancelled", operation_i)
+                return
+            await asyncio.sleep(delay)
@@ -16,6 +16,7 @@
 
 from .bot import BotBackend
 from .scraper import ScraperBackend
+from .simulated import SimulatedBackend
 from .userbot import UserbotBackend
 
-__all__ = ["UserbotBackend", "ScraperBackend", "BotBackend"]
+__all__ = ["UserbotBackend", "ScraperBackend", "BotBackend", "SimulatedBackend"]
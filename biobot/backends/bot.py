@@ -16,20 +16,25 @@
 
 import telethon
 
+from ..ratelimit import RateLimiters
+from ..sessions import make_session
 from . import userbot
 
 
 class BotBackend(userbot.UserbotBackend):
     # noinspection PyMissingConstructor
-    def __init__(self, bot, group_id, api_id, api_hash):
+    def __init__(self, bot, group_id, api_id, api_hash, rate_limits=None, session=None):
         self.token = bot if isinstance(bot, str) else None
-        self._setup_logging((self.token or "<bot>").partition(":")[0])
+        account = (self.token or "<bot>").partition(":")[0]
+        self._setup_logging(account)
+        self.rate_limiters = RateLimiters(rate_limits)
         self.client = (
-            telethon.TelegramClient(telethon.sessions.MemorySession(), api_id, api_hash)
+            telethon.TelegramClient(make_session(session), api_id, api_hash)
             if isinstance(bot, str)
             else bot
         )
         self.group = group_id
+        self._setup_caches(account)
 
     @classmethod
     def get_instances(cls, bot, common_config, configs):
@@ -37,7 +42,7 @@ class BotBackend(userbot.UserbotBackend):
             this_bot = config.pop("bot") or bot
             yield cls(this_bot, **config, **common_config)
 
-    async def init(self):
+    async def init(self, interactive=True):
         if self.token:
             try:
                 await self.client.start(bot_token=self.token)
@@ -45,8 +50,11 @@ class BotBackend(userbot.UserbotBackend):
                 self.logger.error("Bot token expired: %s", self.token.split(":")[0])
                 raise
         self.client.flood_sleep_threshold = 0
+        self._add_roster_handlers()
 
     async def close(self):
         if self.token:
             await super().close()
-        # else we're borrowing the bot and mustn't disconnect
+        else:
+            # we're borrowing the bot and mustn't disconnect, but a recreated backend adds its own handlers
+            self._remove_roster_handlers()
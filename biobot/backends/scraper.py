@@ -14,24 +14,29 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+
 import aiohttp
 from lxml import html
 
-from ..backend import BioTextGetterBackend, Unavailable
+from ..backend import BatchBioTextGetterBackend, NotFound, Unavailable
+from ..ratelimit import RateLimiters
 
 
-class ScraperBackend(BioTextGetterBackend):
-    def __init__(self):
+class ScraperBackend(BatchBioTextGetterBackend):
+    def __init__(self, rate_limits=None):
         self._setup_logging()
         self.session = aiohttp.ClientSession(raise_for_status=True)
+        self.limiter = RateLimiters(rate_limits)["t.me"]
 
     @classmethod
     def get_instances(cls, bot, common_config, configs):
-        return [cls() for _ in configs]
+        return [cls(**config) for config in configs]
 
     async def get_bio_text(self, user):
         if not user.usernames:
-            raise Unavailable("A username is required to scrape.", retry_elsewhere=True)
+            raise NotFound("A username is required to scrape.")
+        await self.limiter.acquire(1)
         async with self.session.get("https://t.me/" + user.usernames[0]) as resp:
             text = await resp.text()
         tree = html.fromstring(text)
@@ -40,7 +45,9 @@ class ScraperBackend(BioTextGetterBackend):
         ):
             # This happens if the username doesn't exist or if we're being rate-limited.
             # Since the user should always exit, we must be rate limited
+            self.limiter.flood(1)
             raise Unavailable("Rate limited.", 1, True)
+        self.limiter.success()
         desc = tree.xpath(
             "//div[contains(concat(' ',normalize-space(@class),' '),' tgme_page_description ')]//node()",
             smart_strings=False,
@@ -49,6 +56,12 @@ class ScraperBackend(BioTextGetterBackend):
             (isinstance(e, str) and e) or (e.tag == "br" and "\n") or "" for e in desc
         )
 
+    async def get_bio_texts(self, users):
+        # the requests are pipelined over the session's connection pool
+        return await asyncio.gather(
+            *[self.get_bio_text(user) for user in users], return_exceptions=True
+        )
+
     async def close(self):
         if self.session is not None:
             await self.session.close()
@@ -0,0 +1,184 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import functools
+import random
+from typing import AsyncIterator, Iterable
+
+import telethon
+
+from ..backend import (
+    BatchBioTextGetterBackend,
+    Broken,
+    JoinedUsersGetterBackend,
+    NotFound,
+    Unavailable,
+)
+from ..ratelimit import RateLimiters
+from ..user import User
+
+PAGE_SIZE = 200  # as on Telegram, so that a listing takes as many pages
+FIRST_ID = 1000000  # the ids are offset so that they aren't mistaken for indices
+
+
+@functools.lru_cache(maxsize=8)
+def make_group(
+    members,
+    seed=0,
+    chain_length=20,
+    cycle_rate=0.1,
+    fork_rate=0.02,
+    anonymous_rate=0.05,
+) -> tuple[tuple[User, ...], tuple[str, ...]]:
+    """
+    Return the members of a synthetic group and their bios.
+    The members are split into chains of `chain_length` users on average, where each bio
+    mentions the next user of the chain. A `cycle_rate` fraction of the chains loop back to
+    their first user, a `fork_rate` fraction of the users also mention a random member,
+    and an `anonymous_rate` fraction of the users have no username, so the chain that
+    should mention them ends early.
+    """
+    rng = random.Random(seed)
+    users = tuple(
+        User(
+            FIRST_ID + i,
+            () if rng.random() < anonymous_rate else ("simuser{}".format(i),),
+            False,
+        )
+        for i in range(members)
+    )
+    order = list(range(members))
+    rng.shuffle(order)
+    mentions = [[] for _ in range(members)]
+    start = 0
+    while start < members:
+        length = max(1, round(rng.expovariate(1 / chain_length)))
+        segment = order[start : start + length]
+        start += length
+        for current, following in zip(segment, segment[1:]):
+            mentions[current].append(following)
+        if len(segment) > 1 and rng.random() < cycle_rate:
+            mentions[segment[-1]].append(segment[0])
+    for i in range(members):
+        if rng.random() < fork_rate:
+            mentions[i].append(rng.randrange(members))
+    bios = tuple(
+        " ".join("@" + users[j].usernames[0] for j in mentioned if users[j].usernames)
+        for mentioned in mentions
+    )
+    return users, bios
+
+
+class SimulatedBackend(JoinedUsersGetterBackend, BatchBioTextGetterBackend):
+    """
+    Serves a synthetic group (see make_group) without any network access, for load testing.
+    Every call takes `latency` seconds on average, and `tail_rate` of them take `tail_latency`
+    instead. Calls raise a flood wait of `flood_seconds` with a probability of `flood_rate`,
+    which goes through the rate limiters like a real one. After `broken_after` calls, every
+    call raises Broken, as if the account was banned.
+    """
+
+    max_rate_limit_wait = 1
+    # high enough that the simulated flood waits are the limit, rather than the rate limiters
+    default_rate_limits = {
+        "GetFullUserRequest": (1000, 1000),
+        "GetParticipantsRequest": (1000, 1000),
+    }
+
+    def __init__(
+        self,
+        name="simulated",
+        members=1000,
+        seed=0,
+        chain_length=20,
+        cycle_rate=0.1,
+        fork_rate=0.02,
+        anonymous_rate=0.05,
+        latency=0.05,
+        jitter=0.5,
+        tail_rate=0.0,
+        tail_latency=2.0,
+        flood_rate=0.0,
+        flood_seconds=5,
+        broken_after=None,
+        rate_limits=None,
+    ):
+        self._setup_logging(name)
+        self.users, self.bios = make_group(
+            members, seed, chain_length, cycle_rate, fork_rate, anonymous_rate
+        )
+        self._by_id = {user.id: i for i, user in enumerate(self.users)}
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.broken_after = broken_after
+        self.calls = 0
+        self.rate_limiters = RateLimiters(
+            {**self.default_rate_limits, **(rate_limits or {})}
+        )
+        self._random = random.Random("{}/{}".format(seed, name))
+
+    @classmethod
+    def get_instances(cls, bot, common_config, configs):
+        return [cls(**config) for config in configs]
+
+    async def _call(self, method):
+        """Wait like a request to Telegram would, and fail like one might"""
+        self.calls += 1
+        if self.broken_after is not None and self.calls > self.broken_after:
+            raise Broken("Simulated ban")
+        async with self.rate_limiters[method].limit(self.max_rate_limit_wait):
+            if self._random.random() < self.tail_rate:
+                await asyncio.sleep(self.tail_latency)
+            else:
+                await asyncio.sleep(
+                    self.latency * self._random.lognormvariate(0, self.jitter)
+                )
+            if self._random.random() < self.flood_rate:
+                raise telethon.errors.rpcerrorlist.FloodWaitError(
+                    None, self.flood_seconds
+                )
+
+    async def get_joined_users(self) -> Iterable[User]:
+        return [user async for page in self.iter_joined_users() for user in page]
+
+    async def iter_joined_users(self) -> AsyncIterator[list[User]]:
+        for start in range(0, len(self.users), PAGE_SIZE):
+            try:
+                await self._call("GetParticipantsRequest")
+            except telethon.errors.rpcerrorlist.FloodWaitError as e:
+                raise Unavailable("Flood Wait", e.seconds)
+            yield list(self.users[start : start + PAGE_SIZE])
+
+    async def get_bio_text(self, user) -> str:
+        try:
+            await self._call("GetFullUserRequest")
+        except telethon.errors.rpcerrorlist.FloodWaitError as e:
+            raise Unavailable("Flood Wait", e.seconds)
+        try:
+            return self.bios[self._by_id[user.id]]
+        except KeyError:
+            raise NotFound("User not found in group by this userbot")
+
+    async def get_bio_texts(self, users):
+        return await asyncio.gather(
+            *[self.get_bio_text(user) for user in users], return_exceptions=True
+        )
@@ -14,72 +14,149 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Iterable
+import asyncio
+import collections
+import time
+from typing import AsyncIterator, Iterable
 
 import telethon
 
 from ..backend import (
-    BioTextGetterBackend,
+    BatchBioTextGetterBackend,
     Broken,
     JoinedUsersGetterBackend,
+    NotFound,
     Unavailable,
 )
+from ..events import ChatActionJoinedByRequest
+from ..ratelimit import RateLimiters
+from ..sessions import make_session
 from ..user import User
 
+PAGE_SIZE = 200  # the maximum number of participants returned by Telegram per request
 
-class UserbotBackend(JoinedUsersGetterBackend, BioTextGetterBackend):
-    def __init__(self, phone, api_id, api_hash, group_id, auth_key=None, test_dc=0):
-        self._setup_logging(phone + "@" + str(test_dc))
+# InputUser of each user id seen in the group, for each account. The index of an account is shared
+# by its backends and outlives them when they are recreated. Access hashes are only valid for
+# the account that received them, so the indices of different accounts can't be merged.
+INPUT_USERS = collections.defaultdict(dict)
+
+
+def participants_hash(ids) -> int:
+    """The hash of a page of participants that Telegram compares to tell if it changed"""
+    ret = 0
+    for id in ids:
+        ret ^= ret >> 21
+        ret ^= (ret << 35) & 0xFFFFFFFFFFFFFFFF
+        ret ^= ret >> 4
+        ret = (ret + id) & 0xFFFFFFFFFFFFFFFF
+    # the hash is sent as a signed long
+    return ret - (1 << 64) if ret >= 1 << 63 else ret
+
+
+class UserbotBackend(JoinedUsersGetterBackend, BatchBioTextGetterBackend):
+    # Longer waits for the rate limiter make the manager give the request to another backend
+    max_rate_limit_wait = 1
+    # Seconds after which the members are listed again from scratch, even if no change was noticed,
+    # which also picks up the username changes that Telegram doesn't send updates for
+    roster_ttl = 900
+
+    def __init__(
+        self,
+        phone,
+        api_id,
+        api_hash,
+        group_id,
+        auth_key=None,
+        test_dc=0,
+        rate_limits=None,
+        session=None,
+    ):
+        account = phone + "@" + str(test_dc)
+        self._setup_logging(account)
+        self.rate_limiters = RateLimiters(rate_limits)
         self.phone = phone
         self.group_id = group_id
         self.auth_key = auth_key
-        session = (
-            telethon.sessions.MemorySession()
-            if not auth_key
-            else telethon.sessions.StringSession(auth_key)
-        )
-        if test_dc:
-            session.set_dc(test_dc, "149.154.167.40", 80)
-            self.login_code = str(test_dc) * 5
-        else:
-            self.login_code = None
+        self.session = session
+        self.login_code = str(test_dc) * 5 if test_dc else None
         self.client = telethon.TelegramClient(
-            session, api_id, api_hash, connection_retries=None
+            make_session(session, auth_key, test_dc),
+            api_id,
+            api_hash,
+            connection_retries=None,
         )
+        self._setup_caches(account)
+
+    def _setup_caches(self, account):
+        self.input_users = INPUT_USERS[account]
+        # members of the group by id, kept up to date with the join and leave updates
+        self._roster = {}
+        self._roster_listed = None
+        # pages of the last listing, which aren't sent again by Telegram if they are unchanged
+        self._pages = []
 
     @classmethod
     def get_instances(cls, bot, common_config, configs):
         for config in configs:
             yield cls(**common_config, **config)
 
-    async def init(self):
-        if not self.auth_key:
+    async def init(self, interactive=True):
+        if interactive and not self.client.session.auth_key:
             self.logger.info(f"Signing in")
         try:
-            await self.client.start(
-                self.phone,
-                code_callback=self.login_code
-                and (lambda: self.login_code)
-                or (
-                    lambda: input(
-                        f"Enter login the code you received on {self.phone}: "
-                    )
-                ),
-            )
+            if interactive:
+                await self.client.start(
+                    self.phone,
+                    code_callback=self.login_code
+                    and (lambda: self.login_code)
+                    or (
+                        lambda: input(
+                            f"Enter login the code you received on {self.phone}: "
+                        )
+                    ),
+                )
+            else:
+                # never prompt for or request a login code while the bot is running
+                await self.client.connect()
+                if not await self.client.is_user_authorized():
+                    raise Broken("Not signed in")
         except telethon.errors.rpcerrorlist.AuthKeyDuplicatedError:
             self.logger.error("Unable to sign in due to duplicate auth key")
             raise
-        if not self.auth_key and not self.login_code:
+        # a stored session keeps the login by itself
+        if not self.auth_key and not self.login_code and not self.session:
             self.auth_key = telethon.sessions.StringSession.save(self.client.session)
             self.logger.info(
                 "Please put '%s' as the auth_key in the config.json", self.auth_key
             )
-        async for dialog in self.client.iter_dialogs():
-            if dialog.id == self.group_id:
-                self.group = dialog.entity
-                break
+        # a stored session that already knew the group kept its members from the last run
+        warm = self.session and self._get_cached_entity(self.group_id) is not None
+        self.group = await self._get_group()
         assert isinstance(self.group, telethon.tl.types.Channel)
         self.client.flood_sleep_threshold = 0
+        self._add_roster_handlers()
+        if warm:
+            return
+        # fill the index up front, so that fetching a bio never has to list the group
+        try:
+            await self.get_joined_users()
+        except Unavailable as e:
+            self.logger.warning("Unable to list the group to fill the index: %r", e)
+
+    async def _get_group(self):
+        """Fetch the group directly, looking through the dialogs only if that isn't possible"""
+        try:
+            # Telethon uses the access hash in the session, or tries the id without one
+            return await self.client.get_entity(self.group_id)
+        except ValueError:
+            pass
+        self.logger.warning(
+            "Group %d not cached, looking through the dialogs", self.group_id
+        )
+        async for dialog in self.client.iter_dialogs():
+            if dialog.id == self.group_id:
+                return dialog.entity
+        return None
 
     def get_user(self, entity: telethon.tl.types.User) -> User:
         usernames = (
@@ -92,10 +169,37 @@ class UserbotBackend(JoinedUsersGetterBackend, BioTextGetterBackend):
         return User(entity.id, tuple(usernames), entity.deleted)
 
     async def get_joined_users(self) -> Iterable[User]:
-        ret = []
+        return [user async for page in self.iter_joined_users() for user in page]
+
+    async def iter_joined_users(self) -> AsyncIterator[list[User]]:
         try:
-            async for user in self.client.iter_participants(self.group):
-                ret.append(self.get_user(user))
+            # within the ttl, the roster is only checked for missed joins and leaves
+            fresh = self._roster_is_fresh()
+            if fresh and await self._roster_is_complete():
+                self.logger.debug("Using the roster of %d members", len(self._roster))
+                users = list(self._roster.values())
+                for start in range(0, len(users), PAGE_SIZE):
+                    yield users[start : start + PAGE_SIZE]
+                return
+            roster = {}
+            pages = []
+            offset = 0
+            while True:
+                cached = None
+                if fresh and len(pages) < len(self._pages):
+                    cached = self._pages[len(pages)]
+                page, listed = await self._get_participants_page(offset, cached)
+                if not listed:
+                    break
+                offset += listed
+                pages.append([user.id for user in page])
+                # members can move between pages while they are listed
+                page = [user for user in page if user.id not in roster]
+                roster.update((user.id, user) for user in page)
+                if page:
+                    yield page
+                if listed < PAGE_SIZE:
+                    break
         except telethon.errors.rpcerrorlist.FloodWaitError as e:
             raise Unavailable("Flood Wait", e.seconds)
         except telethon.errors.rpcerrorlist.UserDeactivatedBanError:
@@ -104,49 +208,144 @@ class UserbotBackend(JoinedUsersGetterBackend, BioTextGetterBackend):
             raise Broken("User deactivated")
         except telethon.errors.rpcerrorlist.AuthKeyDuplicatedError:
             raise Broken("Auth key duplicated")
-        return ret
+        self._roster = roster
+        self._pages = pages
+        if not fresh:
+            self._roster_listed = time.monotonic()
 
-    async def get_bio_text(self, user, entity=None, allow_search=True) -> str:
-        try:
-            try:
-                full = await self.client(
-                    telethon.tl.functions.users.GetFullUserRequest(entity or user.id)
+    def _roster_is_fresh(self) -> bool:
+        return (
+            self._roster_listed is not None
+            and time.monotonic() - self._roster_listed <= self.roster_ttl
+        )
+
+    async def _roster_is_complete(self) -> bool:
+        """Check that no join or leave was missed since the members were listed, in one request"""
+        async with self.rate_limiters["GetFullChannelRequest"].limit(
+            self.max_rate_limit_wait
+        ):
+            full = await self.client(
+                telethon.tl.functions.channels.GetFullChannelRequest(self.group)
+            )
+        return full.full_chat.participants_count == len(self._roster)
+
+    async def _get_participants_page(self, offset, cached=None):
+        """
+        Return the users of a page of members and the number of participants it took up.
+        If `cached` ids are given, Telegram doesn't send the page again if they are unchanged,
+        and the users are taken from the roster instead.
+        """
+        if cached and not all(user_id in self._roster for user_id in cached):
+            cached = None
+        async with self.rate_limiters["GetParticipantsRequest"].limit(
+            self.max_rate_limit_wait
+        ):
+            result = await self.client(
+                telethon.tl.functions.channels.GetParticipantsRequest(
+                    self.group,
+                    telethon.tl.types.ChannelParticipantsSearch(""),
+                    offset,
+                    PAGE_SIZE,
+                    participants_hash(cached) if cached else 0,
                 )
-            except ValueError:
-                self.logger.debug("%r not cached", user)
-                if user.usernames and allow_search:
-                    username = user.usernames[0].casefold()
-                    self.logger.debug("Searching for %s", username)
-                    async for found_user in self.client.iter_participants(
-                        self.group, search=username
-                    ):
-                        parsed_found_user = self.get_user(found_user)
-                        if any(
-                            found_username.casefold() == username
-                            for found_username in parsed_found_user.usernames
-                        ):
-                            break
-                    else:
-                        self.logger.debug("Didn't find user %s", username)
-                        return ""
-                elif user.id and allow_search:
-                    self.logger.debug("Fetching users")
-                    async for found_user in self.client.iter_participants(self.group):
-                        if found_user.id == user.id:
-                            break
-                    else:
-                        raise Unavailable(
-                            "User not found in group by this userbot",
-                            retry_elsewhere=True,
-                        )
-                else:
-                    # not allow_search
-                    raise Unavailable(
-                        "User not found in group by this userbot with disallowed searches",
-                        retry_elsewhere=True,
-                    )
-                self.logger.debug("Fetching bio for %r", user)
-                return await self.get_bio_text(user, found_user, False)
+            )
+        if isinstance(
+            result, telethon.tl.types.channels.ChannelParticipantsNotModified
+        ):
+            return [self._roster[user_id] for user_id in cached], len(cached)
+        users = {user.id: user for user in result.users}
+        self._index(result.users)
+        ret = []
+        for participant in result.participants:
+            if isinstance(participant, telethon.tl.types.ChannelParticipantBanned):
+                if not isinstance(participant.peer, telethon.tl.types.PeerUser):
+                    continue
+                user_id = participant.peer.user_id
+            else:
+                user_id = participant.user_id
+            ret.append(self.get_user(users[user_id]))
+        return ret, len(result.participants)
+
+    def _add_roster_handlers(self):
+        """Keep the roster up to date with the joins, leaves and username changes in the group"""
+        self.client.add_event_handler(
+            self._on_chat_action, telethon.events.ChatAction(chats=self.group)
+        )
+        # Telethon's ChatAction doesn't recognise joins through an invite that needs approval
+        self.client.add_event_handler(
+            self._on_joined, ChatActionJoinedByRequest(chats=self.group)
+        )
+        self.client.add_event_handler(
+            self._on_user_name, telethon.events.Raw(telethon.tl.types.UpdateUserName)
+        )
+
+    def _remove_roster_handlers(self):
+        self.client.remove_event_handler(self._on_chat_action)
+        self.client.remove_event_handler(self._on_joined)
+        self.client.remove_event_handler(self._on_user_name)
+
+    async def _on_chat_action(self, event):
+        if event.user_joined or event.user_added:
+            await self._on_joined(event)
+        elif event.user_left or event.user_kicked:
+            for user_id in event.user_ids:
+                self._roster.pop(user_id, None)
+
+    async def _on_joined(self, event):
+        users = event.users
+        if len(users) != len(event.user_ids):
+            # list the members again, since the usernames of these ones aren't known
+            self._roster_listed = None
+            return
+        for user in users:
+            self._roster[user.id] = self.get_user(user)
+        self._index(users)
+
+    async def _on_user_name(self, update):
+        user = self._roster.get(update.user_id, None)
+        if user is not None:
+            self._roster[user.id] = User(
+                user.id,
+                tuple(username.username for username in update.usernames),
+                user.deleted,
+            )
+
+    def _index(self, users):
+        for user in users:
+            if (
+                isinstance(user, telethon.tl.types.User)
+                and user.access_hash is not None
+                and not user.min
+            ):
+                self.input_users[user.id] = telethon.tl.types.InputUser(
+                    user.id, user.access_hash
+                )
+
+    def _get_cached_entity(self, peer):
+        """Return the input entity of the peer from the session without any requests, or None"""
+        try:
+            return self.client.session.get_input_entity(peer)
+        except ValueError:
+            return None
+
+    async def _get_full_user(self, entity):
+        async with self.rate_limiters["GetFullUserRequest"].limit(
+            self.max_rate_limit_wait
+        ):
+            return await self.client(
+                telethon.tl.functions.users.GetFullUserRequest(entity)
+            )
+
+    async def get_bio_text(self, user) -> str:
+        entity = self.input_users.get(user.id, None)
+        if entity is None and user.id is not None:
+            # the session also has the users seen outside the group, and those of earlier runs
+            entity = self._get_cached_entity(telethon.tl.types.PeerUser(user.id))
+        if entity is None:
+            self.logger.debug("%r not cached", user)
+            raise NotFound("User not found in group by this userbot")
+        try:
+            full = await self._get_full_user(entity)
         except telethon.errors.rpcerrorlist.FloodWaitError as e:
             raise Unavailable("Flood Wait", e.seconds)
         except telethon.errors.rpcerrorlist.UserDeactivatedBanError:
@@ -157,6 +356,12 @@ class UserbotBackend(JoinedUsersGetterBackend, BioTextGetterBackend):
             raise Broken("Auth key duplicated")
         return full.full_user.about or ""
 
+    async def get_bio_texts(self, users):
+        # Telethon multiplexes the requests over the one connection
+        return await asyncio.gather(
+            *[self.get_bio_text(user) for user in users], return_exceptions=True
+        )
+
     async def close(self):
         if self.client is not None:
             await self.client.disconnect()
@@ -14,6 +14,7 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import base64
 import datetime
 import io
@@ -24,8 +25,12 @@ import time
 import telethon
 from telethon.tl.custom.button import Button
 
-from . import core, log
+from . import core, log, metrics, trace
 from .backends.bot import BotBackend
+from .events import ChatActionJoinedByRequest
+from .ratelimit import RateLimiters
+from .scheduler import PRIORITY_INTERACTIVE, deadline, priority
+from .sessions import make_session
 from .translations import tr
 from .user import get_bio_links, node_to_user
 from .utils import (
@@ -34,8 +39,9 @@ from .utils import (
     format_backend,
     send,
     error_handler,
+    escape,
     protected,
-    ChatActionJoinedByRequest,
+    ProgressReporter,
 )
 
 logger = logging.getLogger(__name__)
@@ -57,7 +63,10 @@ class BioBot:
         rules_username,
         extra_groups=[],
         sudo_users=[],
+        snapshot_ttl=60,
+        admission_timeout=120,
         test_dc=0,
+        session=None,
     ):
         self.bot_token, self.main_group, self.admissions_group = (
             bot_token,
@@ -70,12 +79,15 @@ class BioBot:
             rules_username,
         )
         self.extra_groups, self.sudo_users = extra_groups, sudo_users
+        self.snapshot_ttl = snapshot_ttl
+        self.admission_timeout = admission_timeout
+        # crawls of users going through admission, so that they can be cancelled
+        self.admissions = {}
+        self.rate_limiters = RateLimiters()
         self.client = telethon.TelegramClient(
-            telethon.sessions.MemorySession(), api_id, api_hash
+            make_session(session, test_dc=test_dc), api_id, api_hash
         )
         self.client.parse_mode = "html"
-        if test_dc:
-            self.client.session.set_dc(test_dc, "149.154.167.40", 80)
 
     async def init(self):
         await self.client.start(bot_token=self.bot_token)
@@ -95,6 +107,7 @@ class BioBot:
     async def add_handlers(self):
         start = r"^(?:\/|!)"
         eoc = rf"(?:@{self.username}|(?=\s)|$)"
+        fresh = r"!?"  # not a group, so that the numbering is unchanged
         data = r"(?:(?:#data_?)?(\d+))"
         username = r"(?:@?([a-zA-Z0-9_]{4,}|[0-9]+))"
 
@@ -106,21 +119,27 @@ class BioBot:
         )
         self.client.add_event_handler(
             self.chain_command,
-            telethon.events.NewMessage(pattern=rf"{start}chain{eoc}(?:\s{data})?"),
+            telethon.events.NewMessage(
+                pattern=rf"{start}chain{fresh}{eoc}(?:\s{data})?"
+            ),
         )
         self.client.add_event_handler(
             self.locate_command,
             telethon.events.NewMessage(
-                pattern=rf"{start}locate{eoc}(?:\s{data})?(?:\s{username})?"
+                pattern=rf"{start}locate{fresh}{eoc}(?:\s{data})?(?:\s{username})?"
             ),
         )
         self.client.add_event_handler(
             self.notinchain_command,
-            telethon.events.NewMessage(pattern=rf"{start}notinchain{eoc}(?:\s{data})?"),
+            telethon.events.NewMessage(
+                pattern=rf"{start}notinchain{fresh}{eoc}(?:\s{data})?"
+            ),
         )
         self.client.add_event_handler(
             self.allchains_command,
-            telethon.events.NewMessage(pattern=rf"{start}allchains{eoc}(?:\s{data})?"),
+            telethon.events.NewMessage(
+                pattern=rf"{start}allchains{fresh}{eoc}(?:\s{data})?"
+            ),
         )
         self.client.add_event_handler(
             self.fetchdata_command,
@@ -131,19 +150,19 @@ class BioBot:
         self.client.add_event_handler(
             self.diff_command,
             telethon.events.NewMessage(
-                pattern=rf"{start}tdiff{eoc}(?:\s{data}(?:\s{data})?)?"
+                pattern=rf"{start}tdiff{fresh}{eoc}(?:\s{data}(?:\s{data})?)?"
             ),
         )
         self.client.add_event_handler(
             self.gdiff_command,
             telethon.events.NewMessage(
-                pattern=rf"{start}gdiff{eoc}(?:\s{data}(?:\s{data})?)?(?:\s\.(\w+))?"
+                pattern=rf"{start}gdiff{fresh}{eoc}(?:\s{data}(?:\s{data})?)?(?:\s\.(\w+))?"
             ),
         )
         self.client.add_event_handler(
             self.link_command,
             telethon.events.NewMessage(
-                pattern=rf"{start}(?:perma)?link{eoc}(?:\s{data})?(?:\s{username})?"
+                pattern=rf"{start}(?:perma)?link{fresh}{eoc}(?:\s{data})?(?:\s{username})?"
             ),
         )
         self.client.add_event_handler(
@@ -160,6 +179,10 @@ class BioBot:
                 pattern=rf"{start}log_capacity{eoc}(?:\s(\d+))?"
             ),
         )
+        self.client.add_event_handler(
+            self.stats_command,
+            telethon.events.NewMessage(pattern=rf"{start}stats{eoc}"),
+        )
         self.client.add_event_handler(
             self.user_joined_admission,
             telethon.events.ChatAction(
@@ -202,7 +225,7 @@ class BioBot:
 
     @error_handler
     async def help_command(self, event):
-        await send(event, await tr(event, "help"))
+        await send(event, (await tr(event, "help")).format(self.snapshot_ttl))
 
     @error_handler
     @protected
@@ -215,7 +238,10 @@ class BioBot:
         backend, _ = await self._select_backend(event, error=new)
         if not backend:
             return
-        graph, chain = await core.get_chain(self.target, backend)
+        async with ProgressReporter(event, new) as progress:
+            graph, chain = await core.get_chain(
+                self.target, backend, self._get_max_age(event), progress
+            )
         data = await self._store_data(graph)
         filterfunc = get_user_filter(name)
         ret = filter(filterfunc, chain)
@@ -242,12 +268,15 @@ class BioBot:
     async def chain_command(self, event):
         await self.get_chain(event)
 
-    async def get_chain(self, event):
+    async def get_chain(self, event, max_age=None):
         new = await send(event, await tr(event, "please_wait"))
         backend, _ = await self._select_backend(event, error=new)
         if not backend:
-            return
-        graph, chain = await core.get_chain(self.target, backend)
+            return None, None
+        if max_age is None:
+            max_age = self._get_max_age(event)
+        async with ProgressReporter(event, new) as progress:
+            graph, chain = await core.get_chain(self.target, backend, max_age, progress)
         data = await self._store_data(graph)
         await send(
             new,
@@ -259,7 +288,7 @@ class BioBot:
             ),
             split_on=((" ", "\n"),),
         )
-        return chain
+        return graph, chain
 
     @error_handler
     @protected
@@ -268,7 +297,10 @@ class BioBot:
         backend, _ = await self._select_backend(event, error=new)
         if not backend:
             return
-        graph, antichain = await core.get_notinchain(self.target, backend)
+        async with ProgressReporter(event, new) as progress:
+            graph, antichain = await core.get_notinchain(
+                self.target, backend, self._get_max_age(event), progress
+            )
         data = await self._store_data(graph)
         await send(
             new,
@@ -293,7 +325,10 @@ class BioBot:
         backend, _ = await self._select_backend(event, error=new)
         if not backend:
             return
-        graph, chains = await core.get_chains(backend)
+        async with ProgressReporter(event, new) as progress:
+            graph, chains = await core.get_chains(
+                backend, self._get_max_age(event), progress
+            )
         data = await self._store_data(graph)
         out = [
             " ⇒ ".join(await format_user(chain, False))
@@ -329,9 +364,15 @@ class BioBot:
         new_backend, _ = await self._select_backend(event, 1, error=new)
         if not new_backend:
             return
-        graph, diff = await core.get_diff(
-            old_backend, new_backend, await tr(event, "diff_username_delim"), "\n"
-        )
+        async with ProgressReporter(event, new) as progress:
+            graph, diff = await core.get_diff(
+                old_backend,
+                new_backend,
+                await tr(event, "diff_username_delim"),
+                "\n",
+                max_age=self._get_max_age(event),
+                progress=progress,
+            )
         data = await self._store_data(graph)
         (
             old_only_edges,
@@ -372,9 +413,15 @@ class BioBot:
         format = event.pattern_match[3]
         if format not in ALLOWED_FORMATS:
             format = "svgz"
-        graph, diff = await core.get_gdiff(
-            old_backend, new_backend, self.target, format
-        )
+        async with ProgressReporter(event, new) as progress:
+            graph, diff = await core.get_gdiff(
+                old_backend,
+                new_backend,
+                self.target,
+                format,
+                max_age=self._get_max_age(event),
+                progress=progress,
+            )
         data = await self._store_data(graph)
         caption = (await tr(event, "gdiff_format")).format(
             await format_backend(event, old_backend_id), data
@@ -391,7 +438,8 @@ class BioBot:
             return
         new = await send(event, await tr(event, "please_wait"))
         backend, _ = await self._select_backend(event, error=new)
-        graph = await core.get_bios(backend)
+        async with ProgressReporter(event, new) as progress:
+            graph = await core.get_bios(backend, self._get_max_age(event), progress)
         data = await self._store_data(graph)
         filterfunc = get_user_filter(name)
         ret = filter(filterfunc, map(node_to_user, graph.nodes.values()))
@@ -539,6 +587,19 @@ class BioBot:
             resp = "logs_forbidden"
         await send(event, await tr(event, resp))
 
+    @error_handler
+    async def stats_command(self, event):
+        if event.sender_id not in self.sudo_users:
+            await send(event, await tr(event, "stats_forbidden"))
+            return
+        lines = metrics.summarise()
+        lines.append("Latency by priority:")
+        lines += [
+            "{}: {}".format(name, stats)
+            for name, stats in self.backend.get_priority_stats().items()
+        ]
+        await send(event, "<code>" + escape("\n".join(lines)) + "</code>")
+
     @error_handler
     async def user_joined_admission(self, event):
         cb = None
@@ -578,7 +639,20 @@ class BioBot:
 
     @error_handler
     async def user_joined_main(self, event):
-        chain = await self.get_chain(event)
+        # a crawl started before the join would not contain the new member
+        # dates are truncated to the second, so only crawls started a second later can be shared
+        date = getattr(getattr(event, "action_message", None), "date", None)
+        max_age = max(0, time.time() - date.timestamp() - 1) if date else 0
+        with priority(PRIORITY_INTERACTIVE):
+            graph, chain = await self.get_chain(event, max_age)
+        if graph is None:
+            return
+        if not any(uid == event.user_id for _, uid in graph.nodes(data="uid")):
+            # the backend listed the members from a roster that missed the join
+            logger.warning(
+                "User %d missing from the listing, not kicking", event.user_id
+            )
+            return
         if not any(event.user_id == user.id for user in chain):
             await self.client.kick_participant(self.main_group, event.user_id)
 
@@ -659,7 +733,30 @@ class BioBot:
                 ],
             )
             return
-        graph, chain = await core.get_chain(self.target, self.backend)
+        for_user = int.from_bytes(event.data[1:9], "big")
+        self.admissions[for_user] = asyncio.current_task()
+        try:
+            with priority(PRIORITY_INTERACTIVE), deadline(self.admission_timeout):
+                graph, chain = await core.get_chain(
+                    self.target, self.backend, self.snapshot_ttl
+                )
+        except asyncio.TimeoutError:
+            await message.edit(
+                await tr(event, "loading_timeout"),
+                buttons=[
+                    [Button.inline(await tr(event, "continue"), event.data)],
+                    [Button.inline(await tr(event, "cancel"), b"c" + event.data[1:9])],
+                    [
+                        Button.inline(
+                            await tr(event, "get_help"), b"h" + event.data[1:9] + b"s"
+                        )
+                    ],
+                ],
+            )
+            return
+        finally:
+            if self.admissions.get(for_user, None) is asyncio.current_task():
+                del self.admissions[for_user]
         if input_entity.user_id in {user.id for user in chain}:
             try:
                 await event.answer(await tr(event, "already_in_chain"), alert=True)
@@ -743,13 +840,14 @@ class BioBot:
                 ],
             )
             return
-        invite = await self.client(
-            telethon.tl.functions.messages.ExportChatInviteRequest(
-                self.main_group,
-                expire_date=datetime.timedelta(hours=1),
-                request_needed=True,
+        async with self.rate_limiters["ExportChatInviteRequest"].limit():
+            invite = await self.client(
+                telethon.tl.functions.messages.ExportChatInviteRequest(
+                    self.main_group,
+                    expire_date=datetime.timedelta(hours=1),
+                    request_needed=True,
+                )
             )
-        )
         escaped = (
             base64.urlsafe_b64encode(
                 invite.link.removeprefix("https://").encode("utf-8")
@@ -790,9 +888,20 @@ class BioBot:
         )
 
     async def callback_query_cancel(self, event, message):
+        # withdraw the crawl of the admission, unless someone else is waiting for it too
+        task = self.admissions.pop(int.from_bytes(event.data[1:9], "big"), None)
+        if task is not None:
+            task.cancel()
         await event.answer(await tr(message, "cancelled"), alert=True)
         await message.delete()
 
+    def _get_max_age(self, event):
+        match = getattr(event, "pattern_match", None)
+        if match and re.match(r"^(?:\/|!)\w+!", match[0]):
+            # command suffixed with ! to force a fresh crawl
+            return 0
+        return self.snapshot_ttl
+
     async def _select_backend(
         self, event, match_id=0, *, error=None, default_backend=None
     ):
@@ -840,20 +949,22 @@ class BioBot:
 
     async def _store_data(self, graph):
         graph = graph.copy()
-        await self.client.get_participants(self.main_group)
-        for node, data in graph.nodes.items():
-            if data["uid"] and not data.get("access_hash", None):
-                try:
-                    entity = await self.client.get_input_entity(
-                        telethon.tl.types.PeerUser(data["uid"])
-                    )
-                except (ValueError, TypeError):
-                    entity = None
-                if isinstance(entity, telethon.tl.types.InputPeerUser):
-                    data["access_hash"] = entity.access_hash
+        with trace.span("bot.access_hashes"):
+            await self.client.get_participants(self.main_group)
+            for node, data in graph.nodes.items():
+                if data["uid"] and not data.get("access_hash", None):
+                    try:
+                        entity = await self.client.get_input_entity(
+                            telethon.tl.types.PeerUser(data["uid"])
+                        )
+                    except (ValueError, TypeError):
+                        entity = None
+                    if isinstance(entity, telethon.tl.types.InputPeerUser):
+                        data["access_hash"] = entity.access_hash
         data = io.BytesIO()
         data.name = "chain.gml"
         core.write(graph, data)
         data.seek(0)
-        message = await self.client.send_message(self.data_group, file=data)
+        with trace.span("bot.upload"):
+            message = await self.client.send_message(self.data_group, file=data)
         return "#data_{}".format(message.id)
@@ -22,6 +22,7 @@ import types
 
 import networkx
 
+from biobot import trace
 from biobot.user import FullUser, get_key, node_to_user
 
 
@@ -155,6 +156,7 @@ def _stringize(data):
 # endregion
 
 
+@trace.span("chain.make_graph")
 def make_graph(data) -> networkx.DiGraph:
     if isinstance(data, tuple):
         data, name = data
@@ -197,10 +199,12 @@ def full_users_to_graph(data: list[FullUser]) -> networkx.DiGraph:
 
 
 # region Graph serialization and deserialization
+@trace.span("chain.write")
 def write(graph: networkx.DiGraph, data: io.BytesIO):
     networkx.write_gml(graph, data, stringizer=_stringize)
 
 
+@trace.span("chain.parse_gml")
 def parse_gml(data: bytes) -> networkx.DiGraph:
     graph = networkx.read_gml(io.BytesIO(data), destringizer=_destringize)
     fix_types(graph)  # deserialization is not quite a round trip
@@ -275,6 +279,7 @@ def _score_chain(chain):
     return ret
 
 
+@trace.span("chain.edge_bfs")
 def _edge_bfs(graph, root, get_children):
     # root is returned last
     queue = collections.deque(((None, root),))
@@ -324,6 +329,7 @@ def _edge_bfs(graph, root, get_children):
     return ret
 
 
+@trace.span("chain.make_chain")
 def make_chain(graph: networkx.DiGraph, target: str) -> list[FullUser]:
     # select longest path, preferring chains ending in a username
     return [
@@ -332,6 +338,7 @@ def make_chain(graph: networkx.DiGraph, target: str) -> list[FullUser]:
     ]
 
 
+@trace.span("chain.make_notinchain")
 def make_notinchain(graph: networkx.DiGraph, target: str) -> frozenset[FullUser]:
     chain = make_chain(graph, target)
     return frozenset(
@@ -340,6 +347,7 @@ def make_notinchain(graph: networkx.DiGraph, target: str) -> frozenset[FullUser]
     )
 
 
+@trace.span("chain.make_all_chains")
 def make_all_chains(data: networkx.DiGraph) -> list[list[FullUser]]:
     """
     Get a list of chains possible to generate from the data
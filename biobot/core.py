@@ -15,51 +15,187 @@
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import dataclasses
 import io
+import logging
+import time
+import weakref
 
 import networkx
 
-from . import chain, diff
-from .backend import Backend
+from . import chain, diff, scheduler, trace
+from .backend import Backend, NotFound
 from .user import FullUser
 
+logger = logging.getLogger(__name__)
 
-async def get_bios(backend):
+# Maximum number of bios being fetched at once by a single crawl
+fetch_window = 100
+
+
+@dataclasses.dataclass(frozen=True)
+class Snapshot:
+    time: float  # when the crawl started, so that the age is never underestimated
+    users: list[FullUser]
+    graph: networkx.DiGraph  # shared between callers, so it must not be mutated
+
+
+@dataclasses.dataclass
+class _Crawl:
+    started: float
+    task: asyncio.Task
+    listeners: list  # progress callbacks of every caller waiting for the crawl
+    waiters: int = 0
+
+
+_snapshots = weakref.WeakKeyDictionary()
+_crawls = weakref.WeakKeyDictionary()
+
+
+async def get_bios(backend, max_age, progress=None):
     if not isinstance(backend, Backend):
         return chain.make_graph(backend)
-    users = await backend.get_joined_users()
-    bios = await asyncio.gather(*[backend.get_bio_text(u) for u in users])
+    return (await get_snapshot(backend, max_age, progress)).graph
+
+
+async def get_snapshot(backend, max_age, progress=None) -> Snapshot:
+    """
+    Return the last crawl of the backend if it is at most max_age seconds old,
+    otherwise crawl the group again. A max_age of 0 always forces a fresh crawl.
+    Concurrent callers share a single crawl if it started recently enough for them,
+    which is cancelled if all of them are cancelled or pass their deadline.
+    progress is called after each bio is fetched with the number of bios fetched,
+    the number of users found so far and the estimated number of seconds remaining.
+    """
+    now = time.time()
+    snapshot = _snapshots.get(backend, None)
+    if snapshot is not None and now - snapshot.time <= max_age:
+        return snapshot
+    crawl = _crawls.get(backend, None)
+    if crawl is None or now - crawl.started > max_age:
+        listeners = []
+        # the requests of a crawl take turns with those of other crawls,
+        # and the crawl only ends early when nobody is waiting for it any more
+        with scheduler.flow(), scheduler.deadline(None):
+            task = asyncio.create_task(_crawl(backend, now, listeners))
+        crawl = _Crawl(now, task, listeners)
+        _crawls[backend] = crawl
+    if progress is not None:
+        crawl.listeners.append(progress)
+    deadline = scheduler.current_deadline.get()
+    crawl.waiters += 1
+    try:
+        # the crawl is shared, so one caller being cancelled must not cancel it for the others
+        with trace.span("core.crawl"):
+            return await asyncio.wait_for(
+                asyncio.shield(crawl.task),
+                None if deadline is None else deadline - time.monotonic(),
+            )
+    finally:
+        crawl.waiters -= 1
+        if progress is not None:
+            crawl.listeners.remove(progress)
+        if not crawl.waiters and not crawl.task.done():
+            # withdraw the requests of the crawl
+            crawl.task.cancel()
+            if _crawls.get(backend, None) is crawl:
+                del _crawls[backend]
+
+
+async def _crawl(backend, started, listeners) -> Snapshot:
+    users = []
+    bios = []
+    fetched = 0
+    pending = asyncio.Queue()
+    fetch_started = time.monotonic()
+
+    async def fetch():
+        nonlocal fetched
+        while True:
+            i = await pending.get()
+            if i is None:
+                return
+            try:
+                bios[i] = await backend.get_bio_text(users[i])
+            except NotFound:
+                # the user probably left the group after it was listed
+                logger.warning(
+                    "User %d not found by any backend, leaving their bio empty",
+                    users[i].id,
+                )
+                bios[i] = ""
+            fetched += 1
+            elapsed = time.monotonic() - fetch_started
+            eta = elapsed / fetched * (len(users) - fetched)
+            for listener in tuple(listeners):
+                listener(fetched, len(users), eta)
+
+    async def list_users():
+        # fetch the bios of each page while the next one is still being listed
+        async for page in backend.iter_joined_users():
+            for user in page:
+                pending.put_nowait(len(users))
+                users.append(user)
+                bios.append(None)
+        for _ in workers:
+            pending.put_nowait(None)
+
+    # only a fixed number of bios are fetched at once, so that a large group doesn't flood the backends
+    workers = [asyncio.create_task(fetch()) for _ in range(fetch_window)]
+    tasks = [asyncio.create_task(list_users()), *workers]
+    try:
+        # the first failure of the listing or of a fetch ends the crawl without waiting for the rest
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        errors = [task.exception() for task in done if task.exception() is not None]
+        if errors:
+            raise errors[0]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        crawl = _crawls.get(backend, None)
+        if crawl is not None and crawl.task is asyncio.current_task():
+            del _crawls[backend]
     full_users = [FullUser(user, bio) for user, bio in zip(users, bios)]
-    return chain.make_graph(full_users)
+    snapshot = Snapshot(started, full_users, chain.make_graph(full_users))
+    previous = _snapshots.get(backend, None)
+    if previous is None or previous.time < snapshot.time:
+        _snapshots[backend] = snapshot
+    return snapshot
 
 
-async def get_chain(target, backend):
-    graph = await get_bios(backend)
+async def get_chain(target, backend, max_age, progress=None):
+    graph = await get_bios(backend, max_age, progress)
     return graph, chain.make_chain(graph, target)
 
 
-async def get_notinchain(target, backend):
-    graph = await get_bios(backend)
+async def get_notinchain(target, backend, max_age, progress=None):
+    graph = await get_bios(backend, max_age, progress)
     return graph, chain.make_notinchain(graph, target)
 
 
-async def get_chains(backend):
-    graph = await get_bios(backend)
+async def get_chains(backend, max_age, progress=None):
+    graph = await get_bios(backend, max_age, progress)
     return graph, chain.make_all_chains(graph)
 
 
-async def get_diff(old, backend, *args, **kwargs):
+async def get_diff(old, backend, *args, max_age, progress=None, **kwargs):
     old = chain.make_graph(old)
-    new = await get_bios(backend)
-    return new, await asyncio.to_thread(
-        diff.textual_chain_diff, old, new, *args, **kwargs
-    )
+    new = await get_bios(backend, max_age, progress)
+    with trace.span("core.diff"):
+        return new, await asyncio.to_thread(
+            diff.textual_chain_diff, old, new, *args, **kwargs
+        )
 
 
-async def get_gdiff(old, backend, *args, **kwargs):
+async def get_gdiff(old, backend, *args, max_age, progress=None, **kwargs):
     old = chain.make_graph(old)
-    new = await get_bios(backend)
-    return new, await asyncio.to_thread(diff.draw_chain_diff, old, new, *args, **kwargs)
+    new = await get_bios(backend, max_age, progress)
+    with trace.span("core.gdiff"):
+        return new, await asyncio.to_thread(
+            diff.draw_chain_diff, old, new, *args, **kwargs
+        )
 
 
 def write(graph: networkx.DiGraph, data: io.BytesIO):
@@ -26,6 +26,7 @@ import scipy.spatial
 from matplotlib import pyplot as plt
 from matplotlib.figure import Figure
 
+from . import trace
 from .chain import make_chain
 from .user import node_to_user
 
@@ -105,6 +106,7 @@ def _graph_to_dict(data):
     return ret, names
 
 
+@trace.span("diff.generate")
 def _generate_diff_data(old_graph, new_graph, namer, ignore_edits):
     old_data, old_map = _graph_to_dict(old_graph)
     new_data, new_map = _graph_to_dict(new_graph)
@@ -297,6 +299,12 @@ def textual_chain_diff(old_data, new_data, directed_delim, line_delim):
 
 
 def draw_chain_diff(old_data, new_data, target, format, extension=None):
+    fig, bbox = layout_chain_diff(old_data, new_data, target)
+    return save_chain_diff(fig, bbox, format, extension)
+
+
+def layout_chain_diff(old_data, new_data, target):
+    """Return the figure of the diff, and the bounding box to save it with"""
     dpi = 100
 
     ideal_gap = 0.8 * dpi
@@ -358,21 +366,23 @@ def draw_chain_diff(old_data, new_data, target, format, extension=None):
             }
         else:
             # shortest weighted undirected path in the component
-            dist = dict(
-                nx.shortest_path_length(
-                    sg,
-                    weight="layout_weight",
+            with trace.span("diff.shortest_paths"):
+                dist = dict(
+                    nx.shortest_path_length(
+                        sg,
+                        weight="layout_weight",
+                    )
                 )
-            )
-            for source in dist:
-                for dest in dist:
-                    if source in dist[dest]:
-                        if dest not in dist[source]:
-                            dist[source][dest] = dist[dest][source]
-                        elif dist[source][dest] > dist[dest][source]:
-                            dist[source][dest] = dist[dest][source]
+                for source in dist:
+                    for dest in dist:
+                        if source in dist[dest]:
+                            if dest not in dist[source]:
+                                dist[source][dest] = dist[dest][source]
+                            elif dist[source][dest] > dist[dest][source]:
+                                dist[source][dest] = dist[dest][source]
             logger.debug(dist)
-            this_component_pos = nx.kamada_kawai_layout(sg, dist=dist)
+            with trace.span("diff.kamada_kawai"):
+                this_component_pos = nx.kamada_kawai_layout(sg, dist=dist)
         if edges:
             # the shortest gap between any pair of neighbour nodes shall be ideal_gap
             scale = ideal_gap / (
@@ -526,12 +536,17 @@ def draw_chain_diff(old_data, new_data, target, format, extension=None):
         edge_color="tab:pink",
     )
     nx.draw_networkx_labels(graph, pos, ax=ax, font_size=5)
-    data = io.BytesIO()
-    data.name = "chain." + (extension or format)
 
     # we use a heuristic bbox because "tight" is very slow
     bbox = mpl.transforms.Bbox.from_extents(0, 0, max_x / dpi, max_y / dpi)
-    fig.savefig(data, dpi=dpi, bbox_inches=bbox, format=format)
+    return fig, bbox
+
+
+@trace.span("diff.save")
+def save_chain_diff(fig, bbox, format, extension=None):
+    data = io.BytesIO()
+    data.name = "chain." + (extension or format)
+    fig.savefig(data, dpi=fig.dpi, bbox_inches=bbox, format=format)
     data.seek(0)
     return data
 
@@ -657,6 +672,7 @@ if __debug__:
         return "\n".join(ret)
 
 
+@trace.span("diff.pack")
 def pack_components(component_pos, padding):
     grid = [0]  # each row is a bitmask, 0=free
 
@@ -0,0 +1,35 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import telethon
+from telethon.events.common import EventBuilder
+
+
+class ChatActionJoinedByRequest(EventBuilder):
+    @classmethod
+    def build(cls, update, others=None, self_id=None):
+        if isinstance(
+            update,
+            (
+                telethon.tl.types.UpdateNewMessage,
+                telethon.tl.types.UpdateNewChannelMessage,
+            ),
+        ) and isinstance(update.message, telethon.tl.types.MessageService):
+            msg = update.message
+            action = update.message.action
+            if isinstance(action, telethon.tl.types.MessageActionChatJoinedByRequest):
+                return telethon.events.ChatAction.Event(msg, users=msg.from_id)
@@ -0,0 +1,295 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import bisect
+import logging
+import os
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in labels)
+        + "}"
+    )
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (suffix, labels, value) for each sample of the metric"""
+        for key, value in sorted(self.values.items()):
+            yield "", tuple(zip(self.labelnames, key)), value
+
+    def render(self):
+        yield "# HELP {} {}".format(self.name, self.help)
+        yield "# TYPE {} {}".format(self.name, self.type)
+        for suffix, labels, value in self.samples():
+            yield "{}{}{} {}".format(
+                self.name, suffix, _format_labels(labels), float(value)
+            )
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def clear(self):
+        self.values.clear()
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = _HistogramValue(self.buckets)
+        ret = self.values[key]
+        ret.counts[bisect.bisect_left(self.buckets, value)] += 1
+        ret.sum += value
+        ret.count += 1
+
+    def quantile(self, q, **labels):
+        """Return the upper bound of the bucket containing the q-th quantile, or None if nothing was observed"""
+        value = self.values.get(self._key(labels), None)
+        if value is None or not value.count:
+            return None
+        remaining = q * value.count
+        for bound, count in zip(self.buckets, value.counts):
+            remaining -= count
+            if remaining <= 0:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), value.counts):
+                cumulative += count
+                yield "_bucket", (*labels, ("le", bound)), cumulative
+            yield "_sum", labels, value.sum
+            yield "_count", labels, value.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # called before rendering, to update gauges that are cheaper to compute on demand
+        self.collectors = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self._add(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self._add(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self._add(Histogram(*args, **kwargs))
+
+    def collect(self):
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text format"""
+        self.collect()
+        return "".join(
+            line + "\n" for metric in self.metrics for line in metric.render()
+        )
+
+
+REGISTRY = Registry()
+
+backend_requests = REGISTRY.counter(
+    "biobot_backend_requests_total",
+    "Requests answered by each backend, by result",
+    ("backend", "operation", "result"),
+)
+backend_call_seconds = REGISTRY.histogram(
+    "biobot_backend_call_seconds",
+    "Duration of the calls to each backend, which may serve a batch of requests",
+    ("backend", "operation"),
+)
+flood_wait_seconds = REGISTRY.counter(
+    "biobot_flood_wait_seconds_total",
+    "Seconds of flood wait received for each method",
+    ("method",),
+)
+queue_depth = REGISTRY.gauge(
+    "biobot_queue_depth",
+    "Requests waiting for a backend, by operation",
+    ("operation",),
+)
+backends_up = REGISTRY.gauge(
+    "biobot_backends_up",
+    "Number of working backends",
+)
+command_seconds = REGISTRY.histogram(
+    "biobot_command_seconds",
+    "Duration of each command and event handler, by result",
+    ("command", "result"),
+)
+
+
+def summarise(registry=REGISTRY):
+    """Return a short human readable summary of the metrics, one line per item"""
+    registry.collect()
+    lines = ["Backends:"]
+    results = {}
+    for (backend, operation, result), count in backend_requests.values.items():
+        results.setdefault((backend, operation), {})[result] = count
+    for (backend, operation), counts in sorted(results.items()):
+        total = sum(counts.values())
+        p95 = backend_call_seconds.quantile(0.95, backend=backend, operation=operation)
+        lines.append(
+            "{} {}: {:g} requests, {:.1%} success, {}, p95 {}".format(
+                backend,
+                operation,
+                total,
+                counts.get("success", 0) / total,
+                ", ".join(
+                    "{:g} {}".format(count, result)
+                    for result, count in sorted(counts.items())
+                    if result != "success"
+                )
+                or "no failures",
+                "-" if p95 is None else "{:g}s".format(p95),
+            )
+        )
+    lines.append("Queues:")
+    lines += [
+        "{}: {:g}".format(operation, depth)
+        for (operation,), depth in sorted(queue_depth.values.items())
+    ]
+    lines.append("Flood waits:")
+    lines += [
+        "{}: {:g}s".format(method, seconds)
+        for (method,), seconds in sorted(flood_wait_seconds.values.items())
+    ]
+    lines.append("Commands:")
+    for (command, result), value in sorted(command_seconds.values.items()):
+        p95 = command_seconds.quantile(0.95, command=command, result=result)
+        lines.append(
+            "{} ({}): {} runs, mean {:.2f}s, p95 {:g}s".format(
+                command, result, value.count, value.sum / value.count, p95
+            )
+        )
+    return lines
+
+
+async def _handle(request):
+    return web.Response(
+        text=REGISTRY.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+async def serve(port, host="127.0.0.1"):
+    """Serve the metrics over HTTP on /metrics, returning the runner that stops the server"""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return runner
+
+
+async def write_periodically(path, interval=15):
+    """Write the metrics to the file every interval seconds, for the node exporter textfile collector"""
+    while True:
+        started = time.monotonic()
+        text = REGISTRY.render()
+        # written to a temporary file first so that a half-written file is never read
+        temporary = path + ".tmp"
+        await asyncio.to_thread(_write, temporary, text)
+        os.replace(temporary, path)
+        await asyncio.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+def _write(path, text):
+    with open(path, "w") as file:
+        file.write(text)
@@ -0,0 +1,120 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import logging
+import time
+
+import telethon
+
+from . import metrics
+from .backend import Unavailable
+
+logger = logging.getLogger(__name__)
+
+# Initial (requests per second, burst) for each method, before anything is learnt
+DEFAULT_RATES = {
+    "GetFullUserRequest": (5, 20),
+    "GetParticipantsRequest": (2, 5),
+    "ExportChatInviteRequest": (0.2, 3),
+    "t.me": (2, 10),
+}
+FALLBACK_RATE = (1, 5)
+
+
+class RateLimiter:
+    """
+    Token bucket whose rate is learnt from flood waits.
+    The rate is halved on every flood wait and slowly increased again after each success,
+    so that it settles just below the rate which Telegram tolerates.
+    """
+
+    decrease = 0.5
+    increase = 0.01  # requests per second, per success
+
+    def __init__(self, name, rate, burst, min_rate=1 / 60, max_rate=None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token and return 0, or return the number of seconds until one is available"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self, max_wait=None):
+        """Wait for a token, raising Unavailable if that would take longer than max_wait"""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            if max_wait is not None and wait > max_wait:
+                raise Unavailable("Rate limited ({})".format(self.name), wait)
+            await asyncio.sleep(wait)
+
+    def flood(self, seconds):
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0
+        self._updated = now
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        metrics.flood_wait_seconds.inc(seconds, method=self.name)
+        logger.info(
+            "Flood wait of %ds on %s, reduced rate to %f", seconds, self.name, self.rate
+        )
+
+    def success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    @contextlib.asynccontextmanager
+    async def limit(self, max_wait=None):
+        """Pace the request made inside the context, and learn from the flood wait it may raise"""
+        await self.acquire(max_wait)
+        try:
+            yield
+        except telethon.errors.rpcerrorlist.FloodWaitError as e:
+            self.flood(e.seconds)
+            raise
+        self.success()
+
+
+class RateLimiters(dict):
+    """Map of method name to RateLimiter, created on first use"""
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+
+    def __missing__(self, name):
+        rate, burst = self.rates.get(name, FALLBACK_RATE)
+        self[name] = ret = RateLimiter(name, rate, burst)
+        return ret
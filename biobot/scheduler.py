@@ -0,0 +1,318 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import time
+from typing import Any, Callable, Optional
+
+# Requests of a lower class are always taken first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_COMMAND = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = ("interactive", "command", "background")
+
+# Class of the requests made in this context, which is inherited by the tasks it creates
+current_priority = contextvars.ContextVar("current_priority", default=PRIORITY_COMMAND)
+# (tag, weight) of the crawl or command that the requests made in this context belong to
+current_flow = contextvars.ContextVar("current_flow", default=(None, 1))
+# time.monotonic() after which the requests made in this context are no longer wanted
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+@contextlib.contextmanager
+def priority(value):
+    """Make the requests inside the context with the given priority class"""
+    token = current_priority.set(value)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+@contextlib.contextmanager
+def flow(tag=None, weight=1):
+    """
+    Make the requests inside the context part of a flow, which shares the backends fairly
+    with the other flows of the same class. Each flow gets `weight` requests per turn.
+    A new tag is used if none is given.
+    """
+    token = current_flow.set((object() if tag is None else tag, weight))
+    try:
+        yield
+    finally:
+        current_flow.reset(token)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Fail the requests inside the context with asyncio.TimeoutError if they aren't done
+    within `seconds`, or by the deadline of the outer context if it is sooner.
+    None removes the deadline, for work that is shared with other contexts.
+    """
+    value = None
+    if seconds is not None:
+        value = time.monotonic() + seconds
+        if current_deadline.get() is not None:
+            value = min(value, current_deadline.get())
+    token = current_deadline.set(value)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+@dataclasses.dataclass(eq=False)
+class Request:
+    operation: int
+    args: tuple
+    kwargs: dict
+    fut: asyncio.Future
+    allowed_backends: set
+    retry_count: int
+    priority: int = PRIORITY_COMMAND
+    flow: Any = None
+    weight: int = 1
+    # a duplicate of a request that is taking too long, which is dropped instead of retried
+    hedge: bool = False
+    deadline: Optional[float] = None
+    # trace of the command that made the request, and when it was last put on a queue
+    trace: Any = None
+    queued: float = 0.0
+
+    def __repr__(self):
+        return "Request({}, {!r}, {!r})".format(self.operation, self.args, self.kwargs)
+
+
+class _FairQueue:
+    """Requests of one class, taken from each flow in turn"""
+
+    def __init__(self):
+        self._flows = collections.OrderedDict()
+        self._len = 0
+        # number of requests taken from the flow at the front during its turn
+        self._taken = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for queue in self._flows.values():
+            yield from queue
+
+    def clear(self):
+        self._flows.clear()
+        self._len = 0
+        self._taken = 0
+
+    def append(self, request):
+        self._flows.setdefault(request.flow, collections.deque()).append(request)
+        self._len += 1
+
+    def appendleft(self, request):
+        if request.flow not in self._flows:
+            self._flows[request.flow] = collections.deque()
+            self._taken = 0
+        self._flows[request.flow].appendleft(request)
+        self._flows.move_to_end(request.flow, last=False)
+        self._len += 1
+
+    def popleft(self):
+        tag, queue = next(iter(self._flows.items()))
+        request = queue.popleft()
+        self._len -= 1
+        self._taken += 1
+        if not queue:
+            del self._flows[tag]
+            self._taken = 0
+        elif self._taken >= request.weight:
+            self._flows.move_to_end(tag)
+            self._taken = 0
+        return request
+
+    def remove_last(self, predicate, limit):
+        """Remove and return the last request matching the predicate, looking at `limit` at most"""
+        for tag in reversed(self._flows):
+            queue = self._flows[tag]
+            for i in range(1, min(len(queue), limit) + 1):
+                if predicate(queue[-i]):
+                    request = queue[-i]
+                    del queue[-i]
+                    self._len -= 1
+                    if not queue:
+                        if next(iter(self._flows)) == tag:
+                            self._taken = 0
+                        del self._flows[tag]
+                    return request
+            limit -= len(queue)
+            if limit <= 0:
+                break
+        return None
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Scheduler:
+    """
+    Queues the requests of one operation, with a queue for each backend.
+    A request is put on the queue of the allowed backend that is expected to finish it first,
+    and idle backends steal requests that they are allowed to serve from the longest queue.
+    Requests are never taken by a backend that isn't allowed to serve them.
+    Each queue is split by priority class, and the requests of the lowest class are taken first.
+    Within a class, the flows take turns.
+    """
+
+    # How often an idle actor checks the other queues for work to steal
+    steal_interval = 1.0
+    # How far from the back of a queue to look for a request that the thief may serve
+    steal_scan = 16
+
+    def __init__(self, get_cost: Callable[[Any], float]):
+        self._get_cost = get_cost
+        self._queues = {}
+        # futures of idle actors, which are passed a request directly
+        self._waiters = {}
+        self._concurrency = {}
+
+    def __len__(self):
+        return sum(map(self._queued, self._queues))
+
+    def _queued(self, backend_id, max_priority=PRIORITY_BACKGROUND):
+        return sum(map(len, self._queues[backend_id][: max_priority + 1]))
+
+    def add_backend(self, backend_id, concurrency=1):
+        """Add a backend with `concurrency` actors taking requests from its queue"""
+        self._queues[backend_id] = [_FairQueue() for _ in PRIORITY_NAMES]
+        self._waiters[backend_id] = collections.deque()
+        self._concurrency[backend_id] = concurrency
+
+    def remove_backend(self, backend_id) -> list[Request]:
+        """Stop queueing requests for the backend and return the ones it didn't take"""
+        for waiter in self._waiters.pop(backend_id):
+            waiter.cancel()
+        del self._concurrency[backend_id]
+        return [request for queue in self._queues.pop(backend_id) for request in queue]
+
+    def can_serve(self, allowed_backends) -> bool:
+        return any(backend_id in self._queues for backend_id in allowed_backends)
+
+    def drain(self) -> list[Request]:
+        ret = []
+        for queues in self._queues.values():
+            for queue in queues:
+                ret += queue
+                queue.clear()
+        return ret
+
+    def _expected_finish(self, backend_id, priority):
+        concurrency = self._concurrency[backend_id]
+        # requests that would be taken first and those being served by the actors that aren't idle
+        load = (
+            self._queued(backend_id, priority)
+            + concurrency
+            - len(self._waiters[backend_id])
+        )
+        return (load + 1) * self._get_cost(backend_id) / concurrency
+
+    def put(self, request: Request):
+        request.queued = time.monotonic()
+        backend_id = min(
+            (
+                backend_id
+                for backend_id in request.allowed_backends
+                if backend_id in self._queues
+            ),
+            key=lambda backend_id: self._expected_finish(backend_id, request.priority),
+        )
+        waiters = self._waiters[backend_id]
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(request)
+                return
+        self._queues[backend_id][request.priority].append(request)
+
+    def _steal(self, thief):
+        victim = None
+        # only steal if the victim wouldn't have got to the request before the thief finishes it
+        longest_wait = self._get_cost(thief)
+        for backend_id in self._queues:
+            if backend_id == thief:
+                continue
+            wait = (
+                self._queued(backend_id)
+                * self._get_cost(backend_id)
+                / self._concurrency[backend_id]
+            )
+            if wait > longest_wait:
+                victim, longest_wait = backend_id, wait
+        if victim is None:
+            return None
+        # the requests at the back of the least urgent class would wait the longest
+        scan = self.steal_scan
+        for queue in reversed(self._queues[victim]):
+            request = queue.remove_last(
+                lambda request: thief in request.allowed_backends, scan
+            )
+            if request is not None:
+                return request
+            scan -= len(queue)
+            if scan <= 0:
+                break
+        return None
+
+    def get_nowait(self, backend_id) -> Request:
+        for queue in self._queues[backend_id]:
+            if queue:
+                return queue.popleft()
+        request = self._steal(backend_id)
+        if request is None:
+            raise asyncio.QueueEmpty
+        return request
+
+    async def get(self, backend_id) -> Request:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                return self.get_nowait(backend_id)
+            except asyncio.QueueEmpty:
+                pass
+            waiters = self._waiters[backend_id]
+            waiter = loop.create_future()
+            waiters.append(waiter)
+            handle = loop.call_later(self.steal_interval, _wake, waiter)
+            try:
+                request = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled() and waiter.result():
+                    # a request was passed in just before the actor was cancelled,
+                    # keep it so that it is returned by remove_backend or drain
+                    request = waiter.result()
+                    self._queues[backend_id][request.priority].appendleft(request)
+                raise
+            finally:
+                handle.cancel()
+                if waiter in waiters:
+                    waiters.remove(waiter)
+            if request is not None:
+                return request
@@ -0,0 +1,42 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import telethon
+
+
+def make_session(path=None, auth_key=None, test_dc=0) -> telethon.sessions.Session:
+    """
+    Return a session stored in the SQLite file at `path`, or in memory if there is no path.
+    A stored session keeps the login, the access hashes of every entity seen and the update
+    state across restarts. The `auth_key` (a StringSession) logs in a new stored session.
+    Each client needs its own file.
+    """
+    if path is None:
+        session = (
+            telethon.sessions.StringSession(auth_key)
+            if auth_key
+            else telethon.sessions.MemorySession()
+        )
+    else:
+        session = telethon.sessions.SQLiteSession(path)
+        if session.auth_key is None and auth_key:
+            login = telethon.sessions.StringSession(auth_key)
+            session.set_dc(login.dc_id, login.server_address, login.port)
+            session.auth_key = login.auth_key
+    if test_dc:
+        session.set_dc(test_dc, "149.154.167.40", 80)
+    return session
@@ -0,0 +1,104 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies in exponentially growing buckets.
+    The counts are halved every `half_life` records, so that old latencies are forgotten.
+    """
+
+    def __init__(self, smallest=0.001, factor=1.25, buckets=64, half_life=1000):
+        # upper bound of each bucket, the last bucket has no bound
+        self.bounds = [smallest * factor**i for i in range(buckets)]
+        self.counts = [0.0] * (buckets + 1)
+        self.count = 0
+        self.half_life = half_life
+
+    def record(self, latency):
+        self.counts[bisect.bisect_left(self.bounds, latency)] += 1
+        self.count += 1
+        if not self.count % self.half_life:
+            self.counts = [count / 2 for count in self.counts]
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket containing the q-th quantile, or None if nothing was recorded"""
+        remaining = q * sum(self.counts)
+        if not remaining:
+            return None
+        for bound, count in zip(self.bounds, self.counts):
+            remaining -= count
+            if remaining <= 0:
+                return bound
+        return self.bounds[-1]
+
+
+class BackendStats:
+    """
+    Exponentially weighted moving averages of the latency and success rate
+    of one operation on one backend
+    """
+
+    alpha = 0.1
+
+    def __init__(self, latency=1.0):
+        self.latency = latency
+        self.success_rate = 1.0
+        self.count = 0
+        # durations of the calls that didn't fail, rather than the time per request
+        self.histogram = LatencyHistogram()
+
+    def record(self, latency, success):
+        self.latency += self.alpha * (latency - self.latency)
+        self.success_rate += self.alpha * (success - self.success_rate)
+        self.count += 1
+
+    @property
+    def cost(self):
+        """Expected number of seconds spent per successful request"""
+        return self.latency / max(self.success_rate, 0.01)
+
+    def __repr__(self):
+        return "BackendStats(latency={:.3f}, success_rate={:.3f}, count={})".format(
+            self.latency, self.success_rate, self.count
+        )
+
+
+class LatencyStats:
+    """Count, mean and maximum of latencies since startup, and the number of failures"""
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, latency, success):
+        self.count += 1
+        self.failures += not success
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return "LatencyStats(count={}, failures={}, mean={:.3f}, max={:.3f})".format(
+            self.count, self.failures, self.mean, self.max
+        )
@@ -0,0 +1,104 @@
+#    Bio Bot (Telegram bot for managing the @Bio_Chain_2)
+#    Copyright (C) 2022 Hackintosh Five
+
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import contextlib
+import contextvars
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Total time and number of calls of each phase of a command"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.monotonic()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        total, count = self.spans.get(name, (0.0, 0))
+        self.spans[name] = (total + seconds, count + 1)
+
+    def summary(self):
+        # phases can run concurrently, so their totals may add up to more than the elapsed time
+        return "{} took {:.3f}s: {}".format(
+            self.name,
+            time.monotonic() - self.started,
+            ", ".join(
+                "{} {:.3f}s{}".format(
+                    name, total, "/{}".format(count) if count > 1 else ""
+                )
+                for name, (total, count) in sorted(
+                    self.spans.items(), key=lambda item: item[1][0], reverse=True
+                )
+            )
+            or "no phases",
+        )
+
+
+# Trace of the command being handled in this context, which is inherited by the tasks it creates
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextlib.contextmanager
+def trace(name):
+    """Trace the phases inside the context, and log a summary at the end"""
+    ret = Trace(name)
+    token = current_trace.set(ret)
+    try:
+        yield ret
+    finally:
+        current_trace.reset(token)
+        logger.info("%s", ret.summary(), extra={"trace": ret})
+
+
+class span:
+    """Add the time spent inside the context, or decorated function, to the current trace"""
+
+    def __init__(self, name):
+        self.name = name
+        self._trace = None
+        self._started = None
+
+    def __enter__(self):
+        self._trace = current_trace.get()
+        if self._trace is not None:
+            self._started = time.monotonic()
+
+    def __exit__(self, *exc_info):
+        if self._trace is not None:
+            self._trace.add(self.name, time.monotonic() - self._started)
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            current = current_trace.get()
+            if current is None:
+                # decorated functions can be called in inner loops, so this must stay cheap
+                return func(*args, **kwargs)
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                current.add(name, time.monotonic() - started)
+
+        return wrapper
@@ -14,16 +14,21 @@
 #    You should have received a copy of the GNU Affero General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import functools
+import logging
+import time
 import typing
 
 import grapheme
 import telethon
-from telethon.events.common import EventBuilder
 
+from biobot import metrics, trace
 from biobot.translations import tr
 from biobot.user import FullUser
 
+logger = logging.getLogger(__name__)
+
 
 def get_user_filter(name):
     try:
@@ -228,14 +233,70 @@ async def send(message, text, split_on=("\n", " "), **kwargs):
     return ret
 
 
+class ProgressReporter:
+    """
+    Progress callback for core which edits a message to show how far a crawl has got.
+    Edits are made at most once per interval, and never after the context is exited.
+    """
+
+    def __init__(self, event, message, interval=5):
+        self.event = event
+        self.message = message
+        self.interval = interval
+        self._last = time.monotonic()
+        self._task = None
+        self._closed = False
+
+    def __call__(self, fetched, total, eta):
+        if self._closed or self.message is None:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        self._task = asyncio.create_task(self._edit(fetched, total, eta))
+
+    async def _edit(self, fetched, total, eta):
+        text = (await tr(self.event, "please_wait_progress")).format(
+            fetched, total, round(eta)
+        )
+        try:
+            await send(self.message, text)
+        except telethon.errors.RPCError:
+            logger.warning("Failed to report progress", exc_info=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._closed = True
+        if self._task is not None:
+            # the edit must not overwrite the result
+            await self._task
+
+
 def error_handler(func):
     @functools.wraps(func)
     async def wrapper(self, event):
+        started = time.monotonic()
+        result = "error"
         try:
-            return await func(self, event)
+            with trace.trace(func.__name__):
+                ret = await func(self, event)
+            result = "success"
+            return ret
+        except asyncio.CancelledError:
+            result = "cancelled"
+            raise
         except Exception:
             await event.reply(await tr(event, "fatal_error"))
             raise
+        finally:
+            metrics.command_seconds.observe(
+                time.monotonic() - started, command=func.__name__, result=result
+            )
 
     return wrapper
 
@@ -258,19 +319,3 @@ def protected(func):
 
 def escape(text):
     return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-
-
-class ChatActionJoinedByRequest(EventBuilder):
-    @classmethod
-    def build(cls, update, others=None, self_id=None):
-        if isinstance(
-            update,
-            (
-                telethon.tl.types.UpdateNewMessage,
-                telethon.tl.types.UpdateNewChannelMessage,
-            ),
-        ) and isinstance(update.message, telethon.tl.types.MessageService):
-            msg = update.message
-            action = update.message.action
-            if isinstance(action, telethon.tl.types.MessageActionChatJoinedByRequest):
-                return telethon.events.ChatAction.Event(msg, users=msg.from_id)